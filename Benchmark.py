@@ -0,0 +1,324 @@
+import io
+import os
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+
+import Parser
+from DbPool import set_pool
+from Parser import MroPkg, XmlParse
+from ShareInfo import MysqlInfo
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    DummyAuthorizer, FTPHandler, ThreadedFTPServer = None, None, None
+
+SC_SMR = 'MR.LteScEarfcn MR.LteScPci MR.LteScRSRP MR.LteScRSRQ MR.LteScTadv MR.LteScPHR MR.LteScAOA ' \
+         'MR.LteScSinrUL MR.LteNcEarfcn MR.LteNcPci MR.LteNcRSRP MR.LteNcRSRQ'
+QCI_SMR = 'MR.LteScPlrULQci1 MR.LteScPlrULQci2 MR.LteScPlrDLQci1 MR.LteScPlrDLQci2'
+
+
+def mro_xml(rng: random.Random, enb_id, objects, values):
+    # MRO-S文件：LteScEarfcn主测量组每个对象values条<v>，后跟一个QCI丢包测量组
+    out = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<bulkPmMrDataFile><fileHeader fileFormatVersion="V2.0.1" reportTime="2024-01-01T10:00:00.000"/>',
+           f'<eNB id="{enb_id}"><measurement><smr>{SC_SMR}</smr>']
+    for o in range(objects):
+        out.append(f'<object id="{enb_id * 256 + o % 256}" MmeUeS1apId="{rng.randint(1, 1 << 30)}" '
+                   f'MmeCode="{rng.randint(1, 255)}" MmeGroupId="{rng.randint(1, 65535)}" '
+                   f'TimeStamp="2024-01-01T10:{o % 60:02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d}">')
+        for v in range(values):
+            sc = [rng.randint(0, 65535), rng.randint(0, 503), rng.randint(0, 97), rng.randint(0, 34),
+                  rng.randint(0, 1282), rng.randint(0, 63), rng.randint(0, 719), rng.randint(0, 36)]
+            nc = [rng.randint(0, 65535), rng.randint(0, 503), rng.randint(0, 97), rng.randint(0, 34)] \
+                if v % 3 else ['NIL'] * 4
+            out.append('<v>' + ' '.join(map(str, sc + nc)) + ' </v>')
+        out.append('</object>')
+    out.append(f'</measurement><measurement><smr>{QCI_SMR}</smr>')
+    for o in range(max(1, objects // 10)):
+        out.append(f'<object id="{enb_id * 256 + o}" MmeUeS1apId="{o}" MmeCode="1" MmeGroupId="1" '
+                   f'TimeStamp="2024-01-01T10:00:00.000"><v>{rng.randint(0, 100)} NIL 0 NIL</v></object>')
+    out.append('</measurement></eNB></bulkPmMrDataFile>')
+    return '\n'.join(out).encode('utf-8')
+
+
+def mro_package(path, rng: random.Random, enbs, xmls, objects, values, stored_inner=False):
+    # 外层zip内每个eNB一个内层zip，内层zip内若干XML，与MroPkg.scan_xml_list遍历的结构一致
+    compress = zipfile.ZIP_STORED if stored_inner else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as outer:
+        for e in range(enbs):
+            enb_id = rng.randint(100000, 999999)
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for x in range(xmls):
+                    zf.writestr(f'TD-LTE_MRO_HUAWEI_{enb_id}_20240101100000_{x}.xml',
+                                mro_xml(rng, enb_id, objects, values))
+            outer.writestr(f'{enb_id}.zip', inner.getvalue(), compress_type=compress)
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.rowcount = 1
+
+    def execute(self, query, args=None):
+        self.pool.round_trip()
+        self.pool.statements += 1
+        return 1
+
+    def executemany(self, query, args):
+        self.pool.round_trip()
+        self.pool.statements += 1
+        self.pool.rows += len(args)
+        return len(args)
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeConnection:
+    open = True
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self.pool)
+
+    def commit(self):
+        self.pool.round_trip()
+
+    def rollback(self):
+        pass
+
+    def autocommit(self, value):
+        pass
+
+
+class FakePool:
+    # 进程内假库：不保存数据，每条语句和提交按latency模拟一次网络往返
+    def __init__(self, latency=0.0005):
+        self.latency = latency
+        self.statements = 0
+        self.rows = 0
+
+    def round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @contextmanager
+    def connection(self, autocommit=False):
+        yield FakeConnection(self)
+
+    def bootstrap(self, name, create_func):
+        pass
+
+
+class Bench:
+    def __init__(self):
+        self.results = []
+
+    def record(self, name, seconds, count, nbytes=0, unit='ops'):
+        result = {'name': name, 'seconds': round(seconds, 4), 'count': count, 'unit': unit,
+                  'rate': round(count / seconds, 1) if seconds else 0,
+                  'mb_per_s': round(nbytes / seconds / 1e6, 2) if seconds and nbytes else 0}
+        self.results.append(result)
+        print(f"{name:<22}{count:>10} {unit:<6}{seconds:>9.3f}s{result['rate']:>12.1f}/s"
+              f"{result['mb_per_s']:>10.2f} MB/s")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_parser(bench, mysql_info, packages, repeat, workers=1, fast_path=False):
+    xml_infos = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        Parser.zip_cache.clear()
+        xml_infos = []
+        for path in packages:
+            xml_infos.append((path, MroPkg(mysql_info, path, workers=workers).scan_xml_list()))
+    bench.record('scan_xml_list', time.perf_counter() - start, len(packages) * repeat, unit='pkgs')
+
+    datas = []
+    total = sum(len(xml_list) for _, xml_list in xml_infos)
+    start = time.perf_counter()
+    for path, xml_list in xml_infos:
+        pkg = MroPkg(mysql_info, path, workers=workers)
+        for _, data in pkg.iter_xml_data(xml_list):
+            datas.append(data)
+    nbytes = sum(len(data) for data in datas)
+    bench.record('read_xml_data', time.perf_counter() - start, total, nbytes, unit='xmls')
+
+    out_bytes = 0
+    start = time.perf_counter()
+    for data in datas:
+        out_bytes += len(XmlParse(io.BytesIO(data), mysql_info, fast_path=fast_path).parse().getvalue())
+    bench.record('XmlParse.parse', time.perf_counter() - start, len(datas), nbytes, unit='xmls')
+
+    rows = 0
+    start = time.perf_counter()
+    for data in datas:
+        for _ in XmlParse(io.BytesIO(data), mysql_info, streaming=True, fast_path=fast_path).iter_rows(with_headers=False):
+            rows += 1
+    bench.record('iter_rows(streaming)', time.perf_counter() - start, rows, nbytes, unit='rows')
+    return [xml_info for _, xml_list in xml_infos for xml_info in xml_list]
+
+
+def bench_tasks(bench, mysql_info, xml_list, fake):
+    from Tasks import Task
+    if fake is not None:
+        set_pool(mysql_info, fake)
+    task = Task(mysql_info)
+    ftp_name = f'bench{os.getpid()}'
+    start = time.perf_counter()
+    task.tasks_add(xml_list, ftp_name)
+    bench.record('Task.tasks_add', time.perf_counter() - start, len(xml_list), unit='rows')
+    if fake is not None:
+        print(f"{'':<22}fake db: {fake.statements} statements, {fake.rows} rows")
+
+
+def bench_ftp(bench, packages, work_dir, threads):
+    from Scanner import IncrementalScanner
+    from Sync import FtpDownloader, FtpPool, ftp_connect
+    if ThreadedFTPServer is None:
+        print('pyftpdlib not installed, ftp benchmark skipped')
+        return
+    # 有handler时pyftpdlib不再自行配置INFO级日志
+    logging.getLogger('pyftpdlib').addHandler(logging.NullHandler())
+    logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+    root = os.path.join(work_dir, 'ftproot')
+    os.makedirs(os.path.join(root, 'sync'), exist_ok=True)
+    for path in packages:
+        shutil.copy(path, os.path.join(root, 'sync'))
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('bench', 'bench', root, perm='elr')
+    handler = type('BenchHandler', (FTPHandler,), {'authorizer': authorizer})
+    port = free_port()
+    server = ThreadedFTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ftp_info = types.SimpleNamespace(ftp_name='bench', host='127.0.0.1', port=port, user='bench', passwd='bench',
+                                     sync_path='/sync', down_path=os.path.join(work_dir, 'down'), scan_filter='',
+                                     max_sessions=threads, download_threads=threads)
+    try:
+        with ftp_connect(ftp_info) as ftp:
+            scanner = IncrementalScanner(ftp_info, state_path=os.path.join(work_dir, 'scan.json'))
+            start = time.perf_counter()
+            files = scanner.scan(ftp, '/sync')
+            bench.record('ftp scan', time.perf_counter() - start, len(files), unit='files')
+
+        def fetch(file_info, ftp):
+            local = os.path.join(ftp_info.down_path, os.path.basename(file_info[0]))
+            ftp.download(file_info[0], local)
+            return local
+
+        os.makedirs(ftp_info.down_path, exist_ok=True)
+        downloader = FtpDownloader(FtpPool(ftp_info, threads), fetch, threads)
+        start = time.perf_counter()
+        consumer_done = []
+
+        def consume():
+            for _ in files:
+                consumer_done.append(downloader.done_queue.get())
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for path, size, _ in files:
+            downloader.submit((path, size, 0, 'bench'))
+        consumer.join()
+        downloader.shutdown()
+        bench.record('ftp download', time.perf_counter() - start, len(files), sum(f[1] for f in files),
+                     unit='files')
+    finally:
+        server.close_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MRO pipeline benchmark')
+    parser.add_argument('--packages', type=int, default=4)
+    parser.add_argument('--enbs', type=int, default=8, help='inner zips per package')
+    parser.add_argument('--xmls', type=int, default=4, help='xml files per inner zip')
+    parser.add_argument('--objects', type=int, default=200, help='objects per xml')
+    parser.add_argument('--values', type=int, default=4, help='<v> rows per object')
+    parser.add_argument('--stored-inner', action='store_true', help='store inner zips without compression')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1, help='threads for inner zip inflation and xml reads')
+    parser.add_argument('--seed', type=int, default=20240101)
+    parser.add_argument('--fast-path', action='store_true', help='enable the regex fast path in XmlParse')
+    parser.add_argument('--mysql', choices=['fake', 'local', 'none'], default='fake')
+    parser.add_argument('--fake-latency', type=float, default=0.0005, help='seconds per fake db round trip')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--passwd', default='')
+    parser.add_argument('--db', default='mrobench')
+    parser.add_argument('--ftp', action='store_true', help='also benchmark scan/download against local pyftpdlib')
+    parser.add_argument('--ftp-threads', type=int, default=4)
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--json', default=None, help='write results to this file for later comparison')
+    args = parser.parse_args(argv)
+
+    mysql_info = MysqlInfo.__new__(MysqlInfo)
+    mysql_info.host, mysql_info.port, mysql_info.user, mysql_info.passwd = args.host, args.port, args.user, \
+        args.passwd
+    mysql_info.db_name, mysql_info.tb_name = args.db, None
+    fake = FakePool(args.fake_latency) if args.mysql != 'local' else None
+    if fake is not None:
+        # 解析路径上的ErrorLog也走假库，不去连接真实MySQL
+        set_pool(mysql_info, fake)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='mrobench')
+    os.makedirs(work_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+    packages = []
+    start = time.perf_counter()
+    for i in range(args.packages):
+        path = os.path.join(work_dir, f'MRO_{i:04d}.zip')
+        mro_package(path, rng, args.enbs, args.xmls, args.objects, args.values, args.stored_inner)
+        packages.append(path)
+    print(f'generated {len(packages)} packages in {time.perf_counter() - start:.1f}s under {work_dir}')
+
+    bench = Bench()
+    try:
+        xml_list = bench_parser(bench, mysql_info, packages, args.repeat, args.workers, args.fast_path)
+        if args.mysql != 'none':
+            bench_tasks(bench, mysql_info, xml_list, fake)
+        if args.ftp:
+            bench_ftp(bench, packages, work_dir, args.ftp_threads)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': bench.results}, f, indent=2)
+    return bench.results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -102,7 +102,12 @@ class FTPInfo:
                     'passwd': '',
                     'sync_path': '',
                     'down_path': '',
-                    'scan_filter': ''
+                    'scan_filter': '',
+                    'max_sessions': '4',
+                    'download_threads': '4',
+                    'stream_mode': '0',
+                    'stream_threshold': str(64 * 1024 * 1024),
+                    'stream_max': str(512 * 1024 * 1024)
                 }
                 with open(cfg_path, 'w') as f:
                     self.__config.write(f)
@@ -115,11 +120,18 @@ class FTPInfo:
             self.sync_path = self.__config.get(self.__cfg_name, 'sync_path')
             self.down_path = self.__config.get(self.__cfg_name, 'down_path')
             self.scan_filter = self.__config.get(self.__cfg_name, 'scan_filter')
+            self.max_sessions = int(self.__config.get(self.__cfg_name, 'max_sessions', fallback='4'))
+            self.download_threads = int(self.__config.get(self.__cfg_name, 'download_threads', fallback='4'))
+            self.stream_mode = self.__config.getboolean(self.__cfg_name, 'stream_mode', fallback=False)
+            self.stream_threshold = int(self.__config.get(self.__cfg_name, 'stream_threshold',
+                                                          fallback=str(64 * 1024 * 1024)))
+            self.stream_max = int(self.__config.get(self.__cfg_name, 'stream_max', fallback=str(512 * 1024 * 1024)))
         except (configparser.Error, Exception) as e:
             raise Exception(e)
 
     def update(self, ftp_name=None, host=None, port=None, user=None, passwd=None, sync_path=None, down_path=None,
-               scan_filter=None):
+               scan_filter=None, max_sessions=None, download_threads=None, stream_mode=None, stream_threshold=None,
+               stream_max=None):
         if ftp_name is not None:
             self.__config.set(self.__cfg_name, 'ftp_name', ftp_name)
             self.ftp_name = ftp_name
@@ -144,6 +156,21 @@ class FTPInfo:
         if scan_filter is not None:
             self.__config.set(self.__cfg_name, 'scan_filter', scan_filter)
             self.scan_filter = scan_filter
+        if max_sessions is not None:
+            self.__config.set(self.__cfg_name, 'max_sessions', str(max_sessions))
+            self.max_sessions = int(max_sessions)
+        if download_threads is not None:
+            self.__config.set(self.__cfg_name, 'download_threads', str(download_threads))
+            self.download_threads = int(download_threads)
+        if stream_mode is not None:
+            self.__config.set(self.__cfg_name, 'stream_mode', '1' if stream_mode else '0')
+            self.stream_mode = bool(stream_mode)
+        if stream_threshold is not None:
+            self.__config.set(self.__cfg_name, 'stream_threshold', str(stream_threshold))
+            self.stream_threshold = int(stream_threshold)
+        if stream_max is not None:
+            self.__config.set(self.__cfg_name, 'stream_max', str(stream_max))
+            self.stream_max = int(stream_max)
         try:
             with open(self.__cfg_path, 'w') as f:
                 self.__config.write(f)
@@ -162,10 +189,22 @@ class FTPInfo:
             self.sync_path = self.__config.get(self.__cfg_name, 'sync_path')
             self.down_path = self.__config.get(self.__cfg_name, 'down_path')
             self.scan_filter = self.__config.get(self.__cfg_name, 'scan_filter')
+            self.max_sessions = int(self.__config.get(self.__cfg_name, 'max_sessions', fallback='4'))
+            self.download_threads = int(self.__config.get(self.__cfg_name, 'download_threads', fallback='4'))
+            self.stream_mode = self.__config.getboolean(self.__cfg_name, 'stream_mode', fallback=False)
+            self.stream_threshold = int(self.__config.get(self.__cfg_name, 'stream_threshold',
+                                                          fallback=str(64 * 1024 * 1024)))
+            self.stream_max = int(self.__config.get(self.__cfg_name, 'stream_max', fallback=str(512 * 1024 * 1024)))
         except (configparser.Error, ValueError):
             return False
         return True
 
+    @staticmethod
+    def sections(cfg_path=os.path.join(os.getcwd(), 'configure', 'ftpinfo.ini')):
+        config = configparser.ConfigParser()
+        config.read(cfg_path)
+        return [section for section in config.sections() if config.has_option(section, 'ftp_name')]
+
     def check(self):
         try:
             ftp = ftputil.FTPHost(self.host, self.user, self.passwd, self.port, timeout=60)
@@ -185,16 +224,33 @@ class PerfInfo:
             if not os.path.exists(cfg_path):
                 self.__config[self.__cfg_name] = {
                     'processes': '4',
-                    'threads': '4'
+                    'threads': '4',
+                    'metrics_path': os.path.join(os.getcwd(), 'metrics'),
+                    'metrics_port': '0',
+                    'metrics_interval': '10',
+                    'fast_path': '0'
                 }
                 with open(cfg_path, 'w') as f:
                     self.__config.write(f)
             self.__config.read(cfg_path)
             self.processes = int(self.__config.get(self.__cfg_name, 'processes'))
             self.threads = int(self.__config.get(self.__cfg_name, 'threads'))
+            self._read_metrics()
+            self._read_parser()
         except (configparser.Error, Exception) as e:
             raise Exception(e)
 
+    def _read_metrics(self):
+        # metrics_path为空时不写快照，metrics_port为0时不开HTTP端口
+        self.metrics_path = self.__config.get(self.__cfg_name, 'metrics_path',
+                                              fallback=os.path.join(os.getcwd(), 'metrics'))
+        self.metrics_port = int(self.__config.get(self.__cfg_name, 'metrics_port', fallback='0'))
+        self.metrics_interval = int(self.__config.get(self.__cfg_name, 'metrics_interval', fallback='10'))
+
+    def _read_parser(self):
+        # fast_path为1时XML解析先走正则快速路径，结构不符的文件自动退回lxml
+        self.fast_path = self.__config.getboolean(self.__cfg_name, 'fast_path', fallback=False)
+
     def update(self, processes=None, threads=None):
         if processes is not None:
             self.__config.set(self.__cfg_name, 'processes', str(processes))
@@ -214,6 +270,64 @@ class PerfInfo:
             self.__config.read(self.__cfg_path)
             self.processes = int(self.__config.get(self.__cfg_name, 'processes'))
             self.threads = int(self.__config.get(self.__cfg_name, 'threads'))
+            self._read_metrics()
+            self._read_parser()
+        except (configparser.Error, ValueError):
+            return False
+        return True
+
+
+class SinkInfo:
+    def __init__(self, cfg_path=os.path.join(os.getcwd(), 'configure', 'sink.ini'), cfg_name='Sink'):
+        self.__cfg_path = cfg_path
+        self.__cfg_name = cfg_name
+        os.makedirs(os.path.dirname(cfg_path), exist_ok=True)
+        self.__config = configparser.ConfigParser()
+        try:
+            if not os.path.exists(cfg_path):
+                self.__config[self.__cfg_name] = {
+                    'sink_type': 'none',
+                    'out_path': os.path.join(os.getcwd(), 'output'),
+                    'compression': 'zstd',
+                    'chunk_rows': '100000'
+                }
+                with open(cfg_path, 'w') as f:
+                    self.__config.write(f)
+            self.__config.read(cfg_path)
+            self.sink_type = self.__config.get(self.__cfg_name, 'sink_type')
+            self.out_path = self.__config.get(self.__cfg_name, 'out_path')
+            self.compression = self.__config.get(self.__cfg_name, 'compression')
+            self.chunk_rows = int(self.__config.get(self.__cfg_name, 'chunk_rows'))
+        except (configparser.Error, Exception) as e:
+            raise Exception(e)
+
+    def update(self, sink_type=None, out_path=None, compression=None, chunk_rows=None):
+        if sink_type is not None:
+            self.__config.set(self.__cfg_name, 'sink_type', sink_type)
+            self.sink_type = sink_type
+        if out_path is not None:
+            self.__config.set(self.__cfg_name, 'out_path', out_path)
+            self.out_path = out_path
+        if compression is not None:
+            self.__config.set(self.__cfg_name, 'compression', compression)
+            self.compression = compression
+        if chunk_rows is not None:
+            self.__config.set(self.__cfg_name, 'chunk_rows', str(chunk_rows))
+            self.chunk_rows = int(chunk_rows)
+        try:
+            with open(self.__cfg_path, 'w') as f:
+                self.__config.write(f)
+        except configparser.Error:
+            return False
+        return True
+
+    def read(self):
+        try:
+            self.__config.read(self.__cfg_path)
+            self.sink_type = self.__config.get(self.__cfg_name, 'sink_type')
+            self.out_path = self.__config.get(self.__cfg_name, 'out_path')
+            self.compression = self.__config.get(self.__cfg_name, 'compression')
+            self.chunk_rows = int(self.__config.get(self.__cfg_name, 'chunk_rows'))
         except (configparser.Error, ValueError):
             return False
         return True
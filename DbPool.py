@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import pymysql
+
+import Metrics
+from ShareInfo import MysqlInfo
+
+
+class MysqlPool:
+    def __init__(self, mysql_info: MysqlInfo, max_size=8, wait_timeout=30, ping_idle=30):
+        self.mysql_info = mysql_info
+        self.db_name = mysql_info.db_name or 'mroparse'
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.ping_idle = ping_idle
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._bootstrapped = set()
+
+    def _create(self):
+        return pymysql.connect(
+            host=self.mysql_info.host,
+            port=self.mysql_info.port,
+            user=self.mysql_info.user,
+            password=self.mysql_info.passwd,
+            database=self.db_name,
+            autocommit=False
+        )
+
+    def _take(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if time.time() - last_used < self.ping_idle:
+                return conn
+            # 空闲过久的连接可能已被服务端断开，借出前先ping，失败则丢弃换下一条
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except pymysql.Error:
+                self._close(conn)
+        return self._create()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, autocommit=False):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise pymysql.OperationalError(2013, f"no free connection in pool after {self.wait_timeout}s")
+        conn = None
+        start = time.perf_counter()
+        try:
+            conn = self._take()
+            conn.autocommit(autocommit)
+            yield conn
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            # 连接级错误：该连接不再放回池中
+            if conn is not None:
+                self._close(conn)
+                conn = None
+            raise
+        except BaseException:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except pymysql.Error:
+                    self._close(conn)
+                    conn = None
+            raise
+        finally:
+            # 调用方自行捕获了连接错误时，socket已关闭的连接也不放回
+            if conn is not None and conn.open:
+                with self._lock:
+                    self._idle.append((conn, time.time()))
+            self._slots.release()
+            # 每次借出计一次数据库往返，耗时含借出期间执行的全部语句
+            Metrics.observe('db_roundtrip', time.perf_counter() - start)
+
+    def bootstrap(self, name, create_func):
+        # 建表与索引检查每个进程只执行一次；失败不记录，下次使用时重试
+        if name in self._bootstrapped:
+            return
+        with self.connection() as conn:
+            create_func(conn)
+            conn.commit()
+        self._bootstrapped.add(name)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(mysql_info: MysqlInfo):
+    return os.getpid(), mysql_info.host, mysql_info.port, mysql_info.user, mysql_info.db_name or 'mroparse'
+
+
+def get_pool(mysql_info: MysqlInfo, max_size=8):
+    # 每个进程、每个库一个连接池；fork出的子进程不能复用父进程的socket
+    key = _pool_key(mysql_info)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = MysqlPool(mysql_info, max_size)
+    return pool
+
+
+def set_pool(mysql_info: MysqlInfo, pool):
+    # 替换当前进程该库的连接池，供基准测试注入进程内的假库
+    with _pools_lock:
+        _pools[_pool_key(mysql_info)] = pool
@@ -0,0 +1,232 @@
+import io
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import Metrics
+from Logs import ErrorLog, ParseCache
+from Parser import MroPkg, XmlParse
+from ShareInfo import MysqlInfo, PerfInfo, SinkInfo
+from Sinks import create_sink
+from Tasks import Task, StatusBuffer
+
+_worker = {}
+
+
+def _init_worker(mysql_info: MysqlInfo, sink_info: SinkInfo = None, metrics_path=None, metrics_interval=10,
+                 fast_path=False):
+    # 每个子进程只初始化一次，MroPkg内的zip缓存在同一进程的任务间复用
+    # spawn方式启动的子进程不继承父进程的指标配置，需要在这里重新配置
+    Metrics.configure(metrics_path, metrics_interval)
+    _worker['mysql_info'] = mysql_info
+    _worker['pkg'] = MroPkg(mysql_info)
+    _worker['errlog'] = ErrorLog(mysql_info)
+    _worker['sink'] = create_sink(sink_info, mysql_info)
+    _worker['fast_path'] = fast_path
+
+
+def parse_xml(pkg: MroPkg, xml_info, mysql_info: MysqlInfo, sink=None, data=None, fast_path=False):
+    if data is None:
+        with Metrics.timer('xml_read'):
+            data = pkg.read_xml_data(xml_info)
+    if data is None:
+        Metrics.inc('xml_read_failed')
+        return None
+    start = time.perf_counter()
+    parser = XmlParse(io.BytesIO(data), mysql_info, streaming=True, all_groups=sink is not None,
+                     fast_path=fast_path)
+    rows = 0
+    if sink is None:
+        for _ in parser.iter_rows(with_headers=False):
+            rows += 1
+        _parsed(start, rows)
+        return rows, ''
+    try:
+        for headers, batch in parser.iter_batches():
+            sink.write(headers, batch)
+            rows += len(batch)
+        # 每个XML解析完即落盘，任务标记为parsed时数据已经持久化
+        locations = sink.flush()
+    except Exception:
+        sink.discard()
+        raise
+    _parsed(start, rows)
+    return rows, ';'.join(locations)
+
+
+def _parsed(start, rows):
+    Metrics.observe('xml_parse', time.perf_counter() - start)
+    Metrics.inc('xml_parsed')
+    Metrics.inc('rows_emitted', rows)
+
+
+def parse_task(task):
+    xml_info = {'main': task['main_zip'], 'path': task['sub_zip_path'], 'xml_file': task['xml_file']}
+    try:
+        result = parse_xml(_worker['pkg'], xml_info, _worker['mysql_info'], _worker['sink'],
+                           fast_path=_worker['fast_path'])
+        if result is None:
+            return task['task_id'], False, 0, None
+        return (task['task_id'], True) + result
+    except Exception as e:
+        _worker['errlog'].add_error("parse task {} ({}) error: {}".format(task['task_id'], task['xml_file'], str(e)))
+        return task['task_id'], False, 0, None
+
+
+class ParseProcess(multiprocessing.Process):
+    def __init__(self, manager_dict, mysql_info: MysqlInfo, perf_info: PerfInfo, ftp_name=None, interval=5,
+                 ftp_names=None, sink_info: SinkInfo = None, stale_secs=1800, reclaim_interval=300, max_crashes=2):
+        super().__init__()
+        self.manager_dict = manager_dict
+        self.mysql_info = mysql_info
+        self.perf_info = perf_info
+        self.ftp_name = ftp_name
+        self.ftp_names = ftp_names
+        self.sink_info = sink_info
+        self.interval = interval
+        self.stale_secs = stale_secs
+        self.reclaim_interval = reclaim_interval
+        self.max_crashes = max_crashes
+        self.errlog = None
+        self.mro_tasks = None
+        self.status_buffer = None
+        self.parse_cache = None
+        self.processes = 1
+        # task_id -> 子进程崩溃时该任务在解析中的次数
+        self._crashes = {}
+
+    def run(self):
+        Metrics.configure(self.perf_info.metrics_path, self.perf_info.metrics_interval)
+        self.errlog = ErrorLog(self.mysql_info)
+        self.mro_tasks = Task(self.mysql_info)
+        self.status_buffer = StatusBuffer(self.mro_tasks)
+        self.parse_cache = ParseCache(self.mysql_info)
+        self.processes = max(1, self.perf_info.processes)
+        batch_size = self.processes * max(1, self.perf_info.threads)
+        last_reclaim = 0
+
+        pool = self._new_pool()
+        try:
+            while self.manager_dict['status']:
+                try:
+                    if time.time() - last_reclaim >= self.reclaim_interval:
+                        self._reclaim()
+                        last_reclaim = time.time()
+                    tasks = self._claim(batch_size)
+                    Metrics.gauge('tasks_claimed', len(tasks))
+                    if not tasks:
+                        for i in range(self.interval):
+                            if not self.manager_dict['status']:
+                                break
+                            time.sleep(1)
+                        continue
+                    pool = self._parse(pool, tasks)
+                except Exception as e:
+                    self.errlog.add_error('parse engine error: {}'.format(str(e)))
+        finally:
+            pool.shutdown()
+        self.status_buffer.close()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                   initargs=(self.mysql_info, self.sink_info, self.perf_info.metrics_path,
+                                             self.perf_info.metrics_interval, self.perf_info.fast_path))
+
+    def _parse(self, pool, tasks):
+        # 同一压缩包的任务尽量分给同一个子进程，提高内层zip缓存命中率
+        tasks.sort(key=lambda t: (t['main_zip'], t['sub_zip_path']))
+        normal = [task for task in tasks if task['task_id'] not in self._crashes]
+        suspects = [task for task in tasks if task['task_id'] in self._crashes]
+        chunksize = max(1, len(normal) // (self.processes * 2))
+        results, crashed = self._map(pool, normal, chunksize)
+        deferred = []
+        # 曾随子进程崩溃的任务逐个单独解析，再次崩溃即可确定是该任务所致
+        for i, task in enumerate(suspects):
+            if crashed:
+                deferred = suspects[i:]
+                break
+            done, crashed = self._map(pool, [task], 1)
+            results.extend(done)
+
+        by_id = {task['task_id']: task for task in tasks}
+        parsed, failed, outputs = [], [], []
+        for task_id, ok, rows, output in results:
+            self._crashes.pop(task_id, None)
+            (parsed if ok else failed).append(task_id)
+            if ok:
+                task = by_id[task_id]
+                outputs.append((task['ftp_name'], task['main_zip'], task['sub_zip_path'], task['xml_file'], output))
+        released = [task['task_id'] for task in deferred]
+        if crashed:
+            pool = self._rebuild(pool, crashed)
+            for task in crashed:
+                task_id = task['task_id']
+                count = self._crashes[task_id] = self._crashes.get(task_id, 0) + 1
+                if count >= self.max_crashes:
+                    self._crashes.pop(task_id)
+                    failed.append(task_id)
+                    self.errlog.add_error("parse task {} ({}) crashed the worker pool {} times".format(
+                        task_id, task['xml_file'], count))
+                else:
+                    released.append(task_id)
+        self.status_buffer.add_many(parsed, 'parsed')
+        self.status_buffer.add_many(failed, 'failed')
+        # 崩溃时未完成的任务放回unparse，下一轮重新认领
+        self.status_buffer.add_many(released, 'unparse')
+        Metrics.inc('tasks_parsed', len(parsed))
+        Metrics.inc('tasks_failed', len(failed))
+        self.parse_cache.record_outputs(outputs)
+        return pool
+
+    @staticmethod
+    def _map(pool, tasks, chunksize):
+        # 返回已完成的结果，以及子进程崩溃（如OOM被杀）导致未完成的任务
+        results = []
+        if not tasks:
+            return results, []
+        try:
+            for result in pool.map(parse_task, tasks, chunksize=chunksize):
+                results.append(result)
+        except BrokenProcessPool:
+            return results, tasks[len(results):]
+        return results, []
+
+    def _rebuild(self, pool, crashed):
+        # 进程池一旦损坏，之后的每次提交都会失败，需要整体重建
+        Metrics.inc('pool_rebuilds')
+        self.errlog.add_error('worker pool broken with {} tasks in flight, rebuilding'.format(len(crashed)))
+        pool.shutdown(wait=False, cancel_futures=True)
+        return self._new_pool()
+
+    def _reclaim(self):
+        # 崩溃遗留的parsing任务按uptime超时回收，状态缓冲中的更新先落库，避免误回收已完成的任务
+        self.status_buffer.flush()
+        for ftp_name in self.ftp_names or [self.ftp_name]:
+            count = self.mro_tasks.tasks_reclaim(self.stale_secs, ftp_name)
+            if count:
+                self.errlog.add_error('reclaimed {} stale parsing tasks of {}'.format(count, ftp_name))
+
+    def _claim(self, batch_size):
+        if not self.ftp_names:
+            return self.mro_tasks.tasks_claim(batch_size, self.ftp_name)
+        # 多个FTP源按份额轮流认领，单个源的积压不会挤占其他源；
+        # 认领不满份额的源说明已无积压，其余份额在下一轮分给仍有积压的源，直到凑满batch_size
+        tasks = []
+        active = list(self.ftp_names)
+        while active and len(tasks) < batch_size:
+            share = max(1, (batch_size - len(tasks)) // len(active))
+            still_active = []
+            for ftp_name in active:
+                want = min(share, batch_size - len(tasks))
+                if want <= 0:
+                    break
+                claimed = self.mro_tasks.tasks_claim(want, ftp_name)
+                tasks.extend(claimed)
+                if len(claimed) == want:
+                    still_active.append(ftp_name)
+            active = still_active
+        return tasks
+
+    def stop(self):
+        self.manager_dict['status'] = False
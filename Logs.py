@@ -1,6 +1,19 @@
-import inspect
+import os
+import sys
+import json
+import math
+import time
+import queue
+import tempfile
+import posixpath
+import hashlib
+import threading
+import multiprocessing.util
 import pymysql
+import pymysql.cursors
 from datetime import datetime
+import Metrics
+from DbPool import get_pool
 from ShareInfo import MysqlInfo
 
 
@@ -35,173 +48,470 @@ class __DatabaseManager:
             pass
 
 
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, int(capacity))
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2)) + 1
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
 class DownLog(__DatabaseManager):
-    def __init__(self, mysql_info, ftp_name):
+    def __init__(self, mysql_info, ftp_name, bloom_threshold=1000000):
         super().__init__()
         self.errlog = ErrorLog(mysql_info)
         self.mysqlinfo = mysql_info
         self.ftp_name = ftp_name
         self.mysqlinfo.db_name = mysql_info.db_name or 'mroparse'
         self.mysqlinfo.tb_name = "DownLog"
-        self._connect()
+        self.tb_name = "DownLog"
+        self.bloom_threshold = bloom_threshold
+        self.known = None
+        self.last_time = None
+        self.pool = get_pool(mysql_info)
+        self._bootstrap()
         self.closedb = False
-        print("DL", self.mysqlinfo.tb_name)
-
-    def _connect(self):
-        try:
-            self.conn = pymysql.connect(
-                host=self.mysqlinfo.host,
-                port=self.mysqlinfo.port,
-                user=self.mysqlinfo.user,
-                password=self.mysqlinfo.passwd,
-                database=self.mysqlinfo.db_name,
-                autocommit=True
-            )
-            self.cursor = self.conn.cursor()
-            self._create_table()
+
+    def _bootstrap(self):
+        try:
+            self.pool.bootstrap(self.tb_name, self._create_table)
         except pymysql.Error as e:
-            self.cursor, self.conn = None, None
             self.errlog.add_error(e)
 
-    def _create_table(self):
-        try:
-            self.cursor.execute(
-                f"SELECT table_name FROM information_schema.tables WHERE table_name='{self.mysqlinfo.tb_name}'")
-            if not self.cursor.fetchone():
-                self.cursor.execute(f"CREATE TABLE {self.mysqlinfo.tb_name} ("
-                                    f"id INT PRIMARY KEY AUTO_INCREMENT, "
-                                    f"ftp_name VARCHAR(255) NOT NULL, "
-                                    f"filepath VARCHAR(255) NOT NULL, "
-                                    f"log_time DATETIME NOT NULL)")
+    def _create_table(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT table_name FROM information_schema.tables "
+                f"WHERE table_name='{self.tb_name}' AND table_schema=DATABASE()")
+            if not cursor.fetchone():
+                cursor.execute(f"CREATE TABLE {self.tb_name} ("
+                               f"id INT PRIMARY KEY AUTO_INCREMENT, "
+                               f"ftp_name VARCHAR(255) NOT NULL, "
+                               f"filepath VARCHAR(255) NOT NULL, "
+                               f"log_time DATETIME NOT NULL, "
+                               f"UNIQUE KEY uk_ftp_file (ftp_name, filepath), "
+                               f"KEY idx_ftp_time (ftp_name, log_time))")
+            else:
+                for index_name, index_sql in [
+                        ('uk_ftp_file', f"CREATE UNIQUE INDEX uk_ftp_file ON {self.tb_name} (ftp_name, filepath)"),
+                        ('idx_ftp_time', f"CREATE INDEX idx_ftp_time ON {self.tb_name} (ftp_name, log_time)")]:
+                    cursor.execute(f"SHOW INDEX FROM {self.tb_name} WHERE KEY_NAME = '{index_name}'")
+                    if cursor.rowcount == 0:
+                        try:
+                            cursor.execute(index_sql)
+                        except pymysql.Error as e:
+                            self.errlog.add_error(e)
 
-                # self.cursor.execute(f"CREATE INDEX filepath_index ON {self.mysqlinfo.tb_name} (filepath)")
-                # self.cursor.execute(f"CREATE INDEX ftp_name_index ON {self.mysqlinfo.tb_name} (ftp_name)")
-                self.conn.commit()
+    def load_known(self):
+        # 一次性读取该ftp_name已下载的全部文件路径，之后的判重在本地完成
+        self._bootstrap()
+        try:
+            with self.pool.connection(autocommit=True) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SELECT COUNT(*), MAX(log_time) FROM {self.tb_name} WHERE ftp_name = %s",
+                                   (self.ftp_name,))
+                    count, last_time = cursor.fetchone()
+                if count > self.bloom_threshold:
+                    known = BloomFilter(count * 2)
+                else:
+                    known = set()
+                with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                    cursor.execute(f"SELECT filepath FROM {self.tb_name} WHERE ftp_name = %s", (self.ftp_name,))
+                    for (filepath,) in cursor:
+                        known.add(filepath)
+            self.known, self.last_time = known, last_time
+        except pymysql.Error as e:
+            self.errlog.add_error(e)
+            return False
+        return True
 
+    def refresh(self):
+        # 只增量读取上次加载之后写入的记录
+        if self.known is None or self.last_time is None:
+            return self.load_known()
+        try:
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.execute(f"SELECT filepath, log_time FROM {self.tb_name} "
+                               f"WHERE ftp_name = %s AND log_time >= %s", (self.ftp_name, self.last_time))
+                for filepath, log_time in cursor.fetchall():
+                    self.known.add(filepath)
+                    if log_time > self.last_time:
+                        self.last_time = log_time
         except pymysql.Error as e:
             self.errlog.add_error(e)
+            return False
+        return True
 
     def isexists(self, filepath):
-        if not self.cursor:
-            self._connect()
-
+        if self.known is None and not self.load_known():
+            return False
+        if filepath not in self.known:
+            return False
+        if isinstance(self.known, set):
+            return True
+        # 布隆过滤器命中可能是误判，回库确认
         try:
-            print(f"SELECT * FROM {self.mysqlinfo.tb_name} WHERE ftp_name = %s AND filepath = %s",
-                                (self.ftp_name, filepath))
-            self.cursor.execute(f"SELECT * FROM {self.mysqlinfo.tb_name} WHERE ftp_name = %s AND filepath = %s",
-                                (self.ftp_name, filepath))
-            result = self.cursor.fetchone()
-            return bool(result) if result else False
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.execute(f"SELECT 1 FROM {self.tb_name} WHERE ftp_name = %s AND filepath = %s LIMIT 1",
+                               (self.ftp_name, filepath))
+                return cursor.fetchone() is not None
         except pymysql.Error as e:
-            print(self.ftp_name, self.mysqlinfo.tb_name, self.mysqlinfo.db_name)
             self.errlog.add_error(e)
             return False
 
     def savelog(self, filepath):
-        if not self.cursor:
-            self._connect()
+        self._bootstrap()
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         try:
-            self.cursor.execute(
-                f"INSERT INTO {self.mysqlinfo.tb_name} (ftp_name, filepath, log_time) VALUES (%s, %s, %s)",
-                (self.ftp_name, filepath, now))
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {self.tb_name} (ftp_name, filepath, log_time) VALUES (%s, %s, %s)",
+                    (self.ftp_name, filepath, now))
         except pymysql.IntegrityError:
-            return True
+            pass
         except pymysql.Error as e:
             self.errlog.add_error(e)
             return False
+        if self.known is not None:
+            self.known.add(filepath)
         return True
 
     def dellog_by_time(self, time=None):
-        if not self.cursor:
-            self._connect()
         if time is None:
             time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         try:
-            self.cursor.execute(f"DELETE FROM {self.mysqlinfo.tb_name} WHERE log_time < %s", (time,))
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.tb_name} WHERE log_time < %s", (time,))
         except pymysql.Error as e:
             self.errlog.add_error(e)
             return False
+        self.known = None
         return True
 
 
-class ErrorLog:
-    def __init__(self, mysql_info: MysqlInfo):
-        self.mysql_info = mysql_info
-        self.mysql_info.db_name = mysql_info.db_name or 'mroparse'
-        self.mysql_info.tb_name = 'ErrorLog'
-        self._connect()
+class ParseCache(__DatabaseManager):
+    def __init__(self, mysql_info, batch_size=500, task_tb_name='mrotasks'):
+        super().__init__()
+        self.errlog = ErrorLog(mysql_info)
+        self.mysqlinfo = mysql_info
+        self.mysqlinfo.db_name = mysql_info.db_name or 'mroparse'
+        self.tb_name = "ParseCache"
+        self.task_tb_name = task_tb_name
+        self.batch_size = batch_size
+        self.pool = get_pool(mysql_info)
+        self._bootstrap()
         self.closedb = False
-    def _connect(self):
-        try:
-            self.conn = pymysql.connect(
-                host=self.mysql_info.host,
-                port=self.mysql_info.port,
-                user=self.mysql_info.user,
-                password=self.mysql_info.passwd,
-                database=self.mysql_info.db_name
-            )
-            self.cursor = self.conn.cursor()
-            self._create_table()
-        except pymysql.Error as e:
-            self.cursor = None
-            self.conn = None
-            raise Exception(f"Error connecting to MySQL: {e}")
-
-    def _create_table(self):
-        try:
-            self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.mysql_info.tb_name} ("
-                                "id INTEGER PRIMARY KEY AUTO_INCREMENT, "
-                                "log_time DATETIME NOT NULL, "
-                                "from_class VARCHAR(255) NOT NULL, "
-                                "from_func VARCHAR(255) NOT NULL,"
-                                "error_text TEXT NOT NULL)")
-            self.conn.commit()
-            try:
-                self.cursor.execute(f"""
-                            CREATE INDEX log_time_index ON {self.mysql_info.tb_name} (log_time);
-                        """)
-                self.conn.commit()
-            except pymysql.Error:
-                pass
+
+    def _bootstrap(self):
+        try:
+            self.pool.bootstrap(self.tb_name, self._create_table)
         except pymysql.Error as e:
-            raise Exception(f"Error creating table: {e}")
+            self.errlog.add_error(e)
 
-    def add_error(self, error_text):
+    def _create_table(self, conn):
+        # 以zip目录中的CRC32、解压后大小和XML文件名作为内容键，重复投递的XML不必解压即可识别
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.tb_name} ("
+                           f"crc INT UNSIGNED NOT NULL, "
+                           f"file_size BIGINT NOT NULL, "
+                           f"xml_name VARCHAR(255) NOT NULL, "
+                           f"ftp_name VARCHAR(255) NOT NULL, "
+                           f"main_zip VARCHAR(255) NOT NULL, "
+                           f"sub_zip_path VARCHAR(255) NOT NULL, "
+                           f"xml_file VARCHAR(255) NOT NULL, "
+                           f"output TEXT NULL, "
+                           f"log_time DATETIME NOT NULL, "
+                           f"location_key CHAR(32) AS "
+                           f"(MD5(CONCAT_WS('|', ftp_name, main_zip, sub_zip_path, xml_file))) STORED, "
+                           f"PRIMARY KEY (crc, file_size, xml_name), "
+                           f"KEY idx_location_key (location_key))")
+
+    @staticmethod
+    def content_key(xml_info):
+        return xml_info['crc'], xml_info['size'], posixpath.basename(xml_info['xml_file'])
+
+    def filter_new(self, xml_list, ftp_name):
+        # 先INSERT IGNORE占位，再回查键的归属：归属本次位置的才是新内容，并发扫描时也不会重复放行。
+        # 占位不等于已解析：output仍为空且原任务失败或未入任务表的键允许改归本次位置，重新解析
+        self._bootstrap()
+        new_list = []
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        caller = inspect.stack()[1]
-        caller_class = caller[0].f_locals.get('self').__class__.__name__
-        caller_method = caller[0].f_code.co_name
+        try:
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                for i in range(0, len(xml_list), self.batch_size):
+                    batch = {}
+                    for xml_info in xml_list[i:i + self.batch_size]:
+                        batch.setdefault(self.content_key(xml_info), xml_info)
+                    cursor.executemany(
+                        f"INSERT IGNORE INTO {self.tb_name} (crc, file_size, xml_name, ftp_name, main_zip, "
+                        f"sub_zip_path, xml_file, log_time) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                        [key + (ftp_name, x['main'], x['path'], x['xml_file'], now) for key, x in batch.items()])
+                    params = [value for key in batch for value in key]
+                    cursor.execute(
+                        f"SELECT c.crc, c.file_size, c.xml_name, c.ftp_name, c.main_zip, c.sub_zip_path, "
+                        f"c.xml_file, c.output, t.task_status FROM {self.tb_name} c "
+                        f"LEFT JOIN {self.task_tb_name} t ON t.task_key = c.location_key "
+                        f"WHERE (c.crc, c.file_size, c.xml_name) IN "
+                        f"({','.join(['(%s, %s, %s)'] * len(batch))})", params)
+                    for crc, file_size, xml_name, owner, main_zip, sub_zip_path, xml_file, output, status \
+                            in cursor.fetchall():
+                        key = (crc, file_size, xml_name)
+                        xml_info = batch.get(key)
+                        if xml_info is None:
+                            continue
+                        location = (ftp_name, xml_info['main'], xml_info['path'], xml_info['xml_file'])
+                        if (owner, main_zip, sub_zip_path, xml_file) == location:
+                            new_list.append(xml_info)
+                        elif output is None and status in (None, 'failed') and \
+                                self._take_over(cursor, key, (owner, main_zip, sub_zip_path, xml_file), location, now):
+                            new_list.append(xml_info)
+        except Exception as e:
+            # 缓存不可用时不丢任务，全部放行
+            self.errlog.add_error(e)
+            return list(xml_list)
+        return new_list
+
+    def _take_over(self, cursor, key, old_location, location, now):
+        # 以原归属为条件更新，并发的两次重投只有一次能接管
+        cursor.execute(
+            f"UPDATE {self.tb_name} SET ftp_name = %s, main_zip = %s, sub_zip_path = %s, xml_file = %s, "
+            f"log_time = %s WHERE crc = %s AND file_size = %s AND xml_name = %s AND output IS NULL "
+            f"AND location_key = MD5(CONCAT_WS('|', %s, %s, %s, %s))",
+            location + (now,) + key + old_location)
+        return cursor.rowcount == 1
 
+    def record_outputs(self, outputs):
+        # outputs: [(ftp_name, main_zip, sub_zip_path, xml_file, output), ...]
+        if not outputs:
+            return True
         try:
-            if not self.cursor:
-                self._connect()
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.executemany(
+                    f"UPDATE {self.tb_name} SET output = %s "
+                    f"WHERE location_key = MD5(CONCAT_WS('|', %s, %s, %s, %s))",
+                    [(output, ftp_name, main_zip, sub_zip_path, xml_file)
+                     for ftp_name, main_zip, sub_zip_path, xml_file, output in outputs])
+        except Exception as e:
+            self.errlog.add_error(e)
+            return False
+        return True
 
-            self.cursor.execute(
-                f"INSERT INTO {self.mysql_info.tb_name} (log_time, from_class, from_func, error_text) "
-                f"VALUES (%s, %s, %s, %s)",
-                (now, caller_class, caller_method, str(error_text).replace("'", "‘")))
-            self.conn.commit()
-        except pymysql.Error as e:
-            raise Exception(f"Error adding error record: {e}")
+
+class _ErrorWriter:
+    # 进程内唯一的错误日志写入线程：add只入队，后台线程按批写库，库不可用时追加到本地spool文件
+    def __init__(self, mysql_info: MysqlInfo, max_queue=10000, batch_size=500, flush_interval=2,
+                 dedup_window=60, spool_path=None):
+        self.mysql_info = mysql_info
+        self.db_name = mysql_info.db_name or 'mroparse'
+        self.tb_name = 'ErrorLog'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+        self.spool_path = spool_path or os.path.join(tempfile.gettempdir(), f'{self.db_name}_ErrorLog.spool')
+        self.queue = queue.Queue(max_queue)
+        self.pool = get_pool(mysql_info)
+        self.dropped = 0
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ErrorLogWriter', daemon=True)
+        self._thread.start()
+        # 子进程退出时multiprocessing会调用Finalize，保证队列中的错误写完
+        self._finalizer = multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def add(self, caller_class, caller_method, error_text):
+        now = time.time()
+        key = (caller_class, caller_method, error_text)
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.dedup_window:
+                # 窗口内重复的错误只计数，窗口结束时写一条汇总
+                seen[1] += 1
+                return
+            self._seen[key] = [now, 0]
+        self._put((now, caller_class, caller_method, error_text))
+
+    def _put(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _expire_seen(self):
+        now = time.time()
+        with self._lock:
+            expired = [(key, count) for key, (first, count) in self._seen.items()
+                       if now - first >= self.dedup_window]
+            for key, _ in expired:
+                del self._seen[key]
+            dropped, self.dropped = self.dropped, 0
+        rows = [(now, caller_class, caller_method, f"{error_text} (repeated {count} times)")
+                for (caller_class, caller_method, error_text), count in expired if count]
+        if dropped:
+            rows.append((now, self.__class__.__name__, '_put', f"error queue full, {dropped} errors dropped"))
+        return rows
+
+    def _create_table(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.tb_name} ("
+                           "id INTEGER PRIMARY KEY AUTO_INCREMENT, "
+                           "log_time DATETIME NOT NULL, "
+                           "from_class VARCHAR(255) NOT NULL, "
+                           "from_func VARCHAR(255) NOT NULL,"
+                           "error_text TEXT NOT NULL, "
+                           "INDEX log_time_index (log_time))")
+
+    def _insert(self, rows):
+        self.pool.bootstrap(self.tb_name, self._create_table)
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {self.tb_name} (log_time, from_class, from_func, error_text) "
+                    f"VALUES (%s, %s, %s, %s)",
+                    [(datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S"), c, f, str(e).replace("'", "‘"))
+                     for t, c, f, e in rows])
+            conn.commit()
+
+    def _spool(self, rows):
+        with open(self.spool_path, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def _replay_spool(self):
+        # 数据库恢复后补写spool中的记录；先改名再读取，避免与其他进程的追加交错
+        if not os.path.exists(self.spool_path):
+            return
+        replay_path = f'{self.spool_path}.{os.getpid()}'
+        try:
+            os.replace(self.spool_path, replay_path)
+        except OSError:
+            return
+        with open(replay_path, 'r', encoding='utf-8') as f:
+            rows = [tuple(json.loads(line)) for line in f if line.strip()]
+        try:
+            for i in range(0, len(rows), self.batch_size):
+                self._insert(rows[i:i + self.batch_size])
+        except Exception:
+            self._spool(rows[i:])
+            raise
+        finally:
+            os.remove(replay_path)
+
+    def _write(self, rows):
+        try:
+            self._insert(rows)
+        except Exception:
+            try:
+                self._spool(rows)
+            except OSError:
+                pass
+            return
+        # 本批已写入，补写spool失败时由_replay_spool自行把未写部分放回spool，不能再把本批写进spool
+        try:
+            self._replay_spool()
+        except Exception:
+            pass
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        last_expire = time.time()
+        while not self._stop.is_set():
+            try:
+                rows = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                rows = []
+            rows.extend(self._drain())
+            if time.time() - last_expire >= self.flush_interval:
+                rows.extend(self._expire_seen())
+                last_expire = time.time()
+                Metrics.gauge('errorlog_queue', self.queue.qsize())
+            if rows:
+                self._write(rows)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(self.flush_interval + 1)
+        self.dedup_window = 0
+        rows = self._expire_seen()
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            rows.extend(batch)
+        for i in range(0, len(rows), self.batch_size):
+            self._write(rows[i:i + self.batch_size])
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _error_writer(mysql_info: MysqlInfo):
+    # 按(pid, 库)缓存，fork出的子进程不会沿用父进程已停止的写线程
+    key = (os.getpid(), mysql_info.host, mysql_info.port, mysql_info.db_name or 'mroparse')
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = _writers[key] = _ErrorWriter(mysql_info)
+    return writer
+
+
+class ErrorLog:
+    def __init__(self, mysql_info: MysqlInfo):
+        self.mysql_info = mysql_info
+        self.db_name = mysql_info.db_name or 'mroparse'
+        self.tb_name = 'ErrorLog'
+        self.writer = _error_writer(mysql_info)
+        self.pool = self.writer.pool
+
+    def add_error(self, error_text):
+        caller = sys._getframe(1)
+        caller_self = caller.f_locals.get('self')
+        caller_class = caller_self.__class__.__name__ if caller_self is not None else caller.f_globals.get('__name__')
+        self.writer.add(caller_class, caller.f_code.co_name, str(error_text))
 
     def del_errors_before(self, start_time, end_time):
         try:
-            if not self.cursor:
-                self._connect()
-            self.cursor.execute(f"DELETE FROM {self.mysql_info.tb_name} WHERE log_time >= %s "
-                                f"AND log_time <= %s", (start_time, end_time))
-            self.conn.commit()
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"DELETE FROM {self.tb_name} WHERE log_time >= %s "
+                                   f"AND log_time <= %s", (start_time, end_time))
+                conn.commit()
         except pymysql.Error as e:
             raise Exception(f"Error deleting error records before time: {e}")
 
     def get_errors_by_time(self, start_time, end_time):
         try:
-            if not self.cursor:
-                self._connect()
-            self.cursor.execute(f"SELECT * FROM {self.mysql_info.tb_name} WHERE log_time >= %s AND log_time <= %s",
-                                (start_time, end_time))
-            results = self.cursor.fetchall()
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.execute(f"SELECT * FROM {self.tb_name} WHERE log_time >= %s AND log_time <= %s",
+                               (start_time, end_time))
+                results = cursor.fetchall()
             return results
         except pymysql.Error as e:
             raise Exception(f"Error querying error records by time: {e}")
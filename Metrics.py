@@ -0,0 +1,184 @@
+import os
+import glob
+import json
+import time
+import bisect
+import threading
+import multiprocessing
+import multiprocessing.util
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟直方图的桶上界（秒），覆盖1ms到5min
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_config = {'path': None, 'interval': 10}
+
+
+def configure(path, interval=10):
+    # 在启动子进程前调用，fork出的进程继承配置，各自首次记录时启动快照线程
+    _config['path'], _config['interval'] = path, interval
+    if path:
+        os.makedirs(path, exist_ok=True)
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = [[0] * (len(BUCKETS) + 1), 0, 0.0]
+            hist[0][index] += 1
+            hist[1] += 1
+            hist[2] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'process': multiprocessing.current_process().name,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: {'buckets': list(hist[0]), 'count': hist[1], 'sum': hist[2]}
+                               for name, hist in self.histograms.items()},
+            }
+
+    def start_writer(self):
+        if self._writer is None and _config['path']:
+            self._writer = threading.Thread(target=self._write_loop, name='MetricsWriter', daemon=True)
+            self._writer.start()
+            multiprocessing.util.Finalize(self, self.write_snapshot, exitpriority=5)
+
+    def snapshot_path(self):
+        return os.path.join(_config['path'], f'{multiprocessing.current_process().name}-{os.getpid()}.json')
+
+    def write_snapshot(self):
+        path = self.snapshot_path()
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        while True:
+            time.sleep(_config['interval'])
+            self.write_snapshot()
+
+
+_registries = {}
+
+
+def registry():
+    # 每个进程一份，fork出的子进程不继承父进程的计数
+    pid = os.getpid()
+    reg = _registries.get(pid)
+    if reg is None:
+        reg = _registries.setdefault(pid, Registry())
+        reg.start_writer()
+    return reg
+
+
+def inc(name, value=1):
+    registry().inc(name, value)
+
+
+def gauge(name, value):
+    registry().set(name, value)
+
+
+def observe(name, seconds):
+    registry().observe(name, seconds)
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry().observe(name, time.perf_counter() - start)
+
+
+def load_snapshots(path, max_age=None):
+    snapshots = []
+    for file_path in glob.glob(os.path.join(path, '*.json')):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if max_age and time.time() - snapshot.get('time', 0) > max_age:
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def render_text(snapshots):
+    # Prometheus文本格式，按进程打标签
+    lines = []
+    for snapshot in sorted(snapshots, key=lambda s: (s['process'], s['pid'])):
+        labels = f'process="{snapshot["process"]}",pid="{snapshot["pid"]}"'
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'mro_{name}_total{{{labels}}} {value}')
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f'mro_{name}{{{labels}}} {value}')
+        for name, hist in sorted(snapshot['histograms'].items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), hist['buckets']):
+                cumulative += count
+                lines.append(f'mro_{name}_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'mro_{name}_seconds_count{{{labels}}} {hist["count"]}')
+            lines.append(f'mro_{name}_seconds_sum{{{labels}}} {hist["sum"]:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    # 汇总各进程的快照文件，在本地端口以文本形式提供
+    def __init__(self, path, port, host='127.0.0.1'):
+        self.path = path
+        self.port = port
+        self.host = host
+        self.httpd = None
+
+    def start(self):
+        path, max_age = self.path, _config['interval'] * 3
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = render_text(load_snapshots(path, max_age)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self.httpd.serve_forever, name='MetricsServer', daemon=True).start()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
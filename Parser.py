@@ -1,19 +1,301 @@
 import io
+import codecs
+import os
 import csv
+import hashlib
+import mmap
+import re
+import struct
+import threading
 from lxml import etree
 import zipfile as mrozip
-from typing import List, Dict, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterator
 
+import Metrics
 from Logs import ErrorLog
 from ShareInfo import MysqlInfo
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class MmapWindow(io.RawIOBase):
+    def __init__(self, buf, start: int = 0, length: Optional[int] = None):
+        super().__init__()
+        self._buf = buf
+        self._start = start
+        self._length = len(buf) - start if length is None else length
+        self._pos = 0
+
+    def __len__(self):
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._length + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if pos < 0:
+            raise ValueError(f"negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        end = self._length if size is None or size < 0 else min(self._pos + size, self._length)
+        if end <= self._pos:
+            return b''
+        data = self._buf[self._start + self._pos:self._start + end]
+        self._pos = end
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read_at(self, offset: int, size: int):
+        return self._buf[self._start + offset:self._start + min(offset + size, self._length)]
+
+    def window(self, start: int, length: int):
+        return MmapWindow(self._buf, self._start + start, length)
+
+
+def _open_main(main_path):
+    with open(main_path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射，交给ZipFile按普通文件处理并报错
+            return mrozip.ZipFile(main_path)
+    return mrozip.ZipFile(MmapWindow(mm))
+
+
+def _open_member(zf, info):
+    # 未压缩且未加密的内层zip直接在外层映射上开窗口读取，不占用内存；压缩的成员只能解压到内存
+    if isinstance(zf.fp, MmapWindow) and info.compress_type == mrozip.ZIP_STORED and not info.flag_bits & 0x1:
+        header = zf.fp.read_at(info.header_offset, mrozip.sizeFileHeader)
+        fields = struct.unpack(mrozip.structFileHeader, header)
+        if fields[0] == mrozip.stringFileHeader:
+            data_start = info.header_offset + mrozip.sizeFileHeader + fields[10] + fields[11]
+            return mrozip.ZipFile(zf.fp.window(data_start, info.file_size)), 0
+    data = zf.read(info)
+    return mrozip.ZipFile(io.BytesIO(data)), len(data)
+
+
+class ZipCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_items: int = 256):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.cur_bytes = 0
+        self._items = OrderedDict()
+        # id(zf) -> 借出次数；借出期间被淘汰的ZipFile暂存在_retired，最后一次归还时关闭
+        self._leases = {}
+        self._retired = {}
+        # 固定的条目不参与LRU淘汰，只在discard/clear时关闭
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def _lease(self, zf):
+        self._leases[id(zf)] = self._leases.get(id(zf), 0) + 1
+
+    def _retire(self, zf):
+        # 调用方持有_lock；无人借用的直接关闭，释放内存或mmap
+        if id(zf) in self._leases:
+            self._retired[id(zf)] = zf
+        else:
+            self._close(zf)
+
+    @staticmethod
+    def _close(zf):
+        try:
+            zf.close()
+        except Exception:
+            pass
+
+    def get(self, key, lease: bool = False):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            if lease:
+                self._lease(item[0])
+            return item[0]
+
+    def put(self, key, zf, nbytes: int = 0, lease: bool = False, pinned: bool = False):
+        with self._lock:
+            if lease:
+                self._lease(zf)
+            if pinned:
+                self._pinned.add(key)
+            else:
+                self._pinned.discard(key)
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.cur_bytes -= old[1]
+                if old[0] is not zf:
+                    self._retire(old[0])
+            self._items[key] = (zf, nbytes)
+            self.cur_bytes += nbytes
+            # 超出字节预算或数量上限时按LRU淘汰并关闭被淘汰的ZipFile，刚放入的和固定的条目除外
+            while self.cur_bytes > self.max_bytes or len(self._items) > self.max_items:
+                old_key = next((k for k in self._items if k != key and k not in self._pinned), None)
+                if old_key is None:
+                    break
+                old_zf, size = self._items.pop(old_key)
+                self.cur_bytes -= size
+                self._retire(old_zf)
+
+    def release(self, zf):
+        with self._lock:
+            count = self._leases.get(id(zf))
+            if count is None:
+                return
+            if count > 1:
+                self._leases[id(zf)] = count - 1
+                return
+            del self._leases[id(zf)]
+            retired = self._retired.pop(id(zf), None)
+            if retired is not None:
+                self._close(retired)
+
+    def discard(self, pkg_key):
+        with self._lock:
+            for key in [k for k in self._items if k[0] == pkg_key]:
+                self._pinned.discard(key)
+                zf, size = self._items.pop(key)
+                self.cur_bytes -= size
+                self._retire(zf)
+
+    def clear(self):
+        with self._lock:
+            items, self._items = self._items, OrderedDict()
+            self._pinned.clear()
+            self.cur_bytes = 0
+            for zf, _ in items.values():
+                self._retire(zf)
+
+
+zip_cache = ZipCache()
+
+
+class InflateBudget:
+    # 限制同时处于解压状态的字节数；单个超出上限的成员在没有其他成员在途时仍放行
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self, nbytes: int) -> bool:
+        with self._cond:
+            if self.in_flight and self.in_flight + nbytes > self.max_bytes:
+                return False
+            self.in_flight += nbytes
+            return True
+
+    def acquire(self, nbytes: int):
+        with self._cond:
+            while self.in_flight and self.in_flight + nbytes > self.max_bytes:
+                self._cond.wait()
+            self.in_flight += nbytes
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.in_flight -= nbytes
+            self._cond.notify_all()
+
 
 class MroPkg:
-    def __init__(self, mysql_info: MysqlInfo, file_path: str = None):
+    def __init__(self, mysql_info: MysqlInfo, file_path: str = None, cache: Optional[ZipCache] = None,
+                 fileobj=None, workers: int = 1, max_inflight_bytes: int = 256 * 1024 * 1024):
         self.mysql_info = mysql_info
         self.file_path = file_path
+        # workers>1时内层zip的解压和XML读取分派到线程池，zlib解压期间释放GIL
+        self.workers = max(1, workers)
+        self.max_inflight_bytes = max_inflight_bytes
+        # fileobj不为空时file_path只作为包的标识，数据从fileobj读取而不是磁盘
+        self.fileobj = fileobj
+        self._root_lock = threading.Lock()
+        self.cache = cache if cache is not None else zip_cache
         self.errlog = ErrorLog(self.mysql_info)
 
+    def _pkg_key(self, main_path):
+        if self.fileobj is not None and main_path == self.file_path:
+            return main_path, 'stream', id(self.fileobj)
+        stat = os.stat(main_path)
+        return main_path, stat.st_size, stat.st_mtime_ns
+
+    def release(self):
+        if self.file_path is not None:
+            try:
+                self.cache.discard(self._pkg_key(self.file_path))
+            except OSError:
+                pass
+
+    @contextmanager
+    def _archive(self, main_path, path_list):
+        zf = self._open_archive(main_path, path_list)
+        try:
+            yield zf
+        finally:
+            self.cache.release(zf)
+
+    def _open_archive(self, main_path, path_list):
+        # 从缓存中查找最长的已打开前缀，只解压剩余的内层zip；返回的ZipFile处于借出状态，用完须release
+        pkg_key = self._pkg_key(main_path)
+        depth, zf = len(path_list), None
+        while depth >= 0:
+            zf = self.cache.get((pkg_key, '->'.join(path_list[:depth])), lease=True)
+            if zf is not None:
+                break
+            depth -= 1
+        if zf is None:
+            depth = 0
+            if self.fileobj is not None and main_path == self.file_path:
+                zf = self._open_stream_root(pkg_key)
+            else:
+                zf = _open_main(main_path)
+                self.cache.put((pkg_key, ''), zf, lease=True)
+        for i in range(depth, len(path_list)):
+            try:
+                sub_zf, nbytes = _open_member(zf, zf.getinfo(path_list[i]))
+            finally:
+                self.cache.release(zf)
+            self.cache.put((pkg_key, '->'.join(path_list[:i + 1])), sub_zf, nbytes, lease=True)
+            zf = sub_zf
+        return zf
+
+    def _open_stream_root(self, pkg_key):
+        # 同一fileobj上的多个ZipFile各自seek/read会互相干扰，流式包的根只打开一次并固定在缓存中，
+        # 直到release时才关闭；加锁避免多个线程同时打开
+        with self._root_lock:
+            zf = self.cache.get((pkg_key, ''), lease=True)
+            if zf is None:
+                zf = mrozip.ZipFile(self.fileobj)
+                self.cache.put((pkg_key, ''), zf, lease=True, pinned=True)
+            return zf
+
     def scan_xml_list(self, file_path: Optional[io.BytesIO] = None,
                       parent_path: Optional[List[str]] = None,
                       max_depth: Optional[int] = None) -> List[Dict[str, str]]:
@@ -22,21 +304,22 @@ class MroPkg:
             if file_path is None:
                 if self.file_path is None:
                     return []
-                file_path = io.BytesIO(open(self.file_path, 'rb').read())
-
-            with mrozip.ZipFile(file_path) as zf:
-                for name in zf.namelist():
-                    try:
-                        if name.endswith('.xml'):
-                            path = parent_path if parent_path else []
-                            xml_list.append(
-                                {'main': self.file_path, 'path': '->'.join(map(str, path)), 'xml_file': name})
-                        elif not name.endswith('/'):
-                            sub_path = parent_path + [name] if parent_path else [name]
-                            with io.BytesIO(zf.read(name)) as sub_file:
-                                xml_list.extend(self.scan_xml_list(sub_file, sub_path, max_depth))
-                    except Exception as e:
-                        self.errlog.add_error(f"Error reading file {name}: {e}")
+                pkg_key = self._pkg_key(self.file_path)
+                zf = self._open_archive(self.file_path, parent_path or [])
+            else:
+                pkg_key = None
+                zf = mrozip.ZipFile(file_path)
+            try:
+                with Metrics.timer('zip_scan'):
+                    if self.workers > 1:
+                        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                            self._scan_archive(zf, parent_path or [], max_depth, xml_list, pkg_key, executor,
+                                               InflateBudget(self.max_inflight_bytes))
+                    else:
+                        self._scan_archive(zf, parent_path or [], max_depth, xml_list, pkg_key)
+            finally:
+                self.cache.release(zf)
+            Metrics.inc('xml_found', len(xml_list))
 
             if max_depth is not None and (not parent_path or len(parent_path) >= max_depth):
                 return xml_list
@@ -46,6 +329,54 @@ class MroPkg:
             self.errlog.add_error(f"Error scanning XML list: {e}")
             return []
 
+    def _scan_archive(self, zf, parent_path, max_depth, xml_list, pkg_key=None, executor=None, budget=None):
+        path = '->'.join(map(str, parent_path))
+        futures = []
+        for info in zf.infolist():
+            name = info.filename
+            try:
+                if name.endswith('.xml'):
+                    xml_list.append({'main': self.file_path, 'path': path, 'xml_file': name,
+                                     'crc': info.CRC, 'size': info.file_size})
+                elif not name.endswith('/'):
+                    sub_path = parent_path + [name]
+                    if executor is None:
+                        self._scan_member(zf, info, sub_path, max_depth, xml_list, pkg_key)
+                    else:
+                        # 只在最外层分派，子任务内部的更深层zip顺序处理，避免线程池内互相等待
+                        sub_list = []
+                        futures.append((name, sub_list, executor.submit(
+                            self._scan_member, zf, info, sub_path, max_depth, sub_list, pkg_key, budget)))
+            except Exception as e:
+                self.errlog.add_error(f"Error reading file {name}: {e}")
+        for name, sub_list, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                self.errlog.add_error(f"Error reading file {name}: {e}")
+            xml_list.extend(sub_list)
+
+    def _scan_member(self, zf, info, sub_path, max_depth, xml_list, pkg_key=None, budget=None):
+        # 存储方式的成员直接开窗口不占内存，只有需要解压的成员计入在途字节
+        nbytes = 0 if info.compress_type == mrozip.ZIP_STORED else info.file_size
+        if budget is not None:
+            budget.acquire(nbytes)
+        try:
+            sub_zf, size = _open_member(zf, info)
+            if pkg_key is not None:
+                self.cache.put((pkg_key, '->'.join(map(str, sub_path))), sub_zf, size, lease=True)
+            try:
+                self._scan_archive(sub_zf, sub_path, max_depth, xml_list, pkg_key)
+            finally:
+                # 未进缓存的内层zip扫描完即关闭，进缓存的归还借用
+                if pkg_key is None:
+                    sub_zf.close()
+                else:
+                    self.cache.release(sub_zf)
+        finally:
+            if budget is not None:
+                budget.release(nbytes)
+
     def read_xml_data(self, xml_info: Dict[str, str]) -> Optional[bytes]:
         try:
             if 'path' not in xml_info or 'xml_file' not in xml_info:
@@ -54,62 +385,412 @@ class MroPkg:
             main_path = xml_info.get('main', self.file_path)
             if main_path is None:
                 return None
-            file_obj = io.BytesIO(open(main_path, 'rb').read())
-            for path in path_list:
-                zf = mrozip.ZipFile(file_obj)
-                sub_file = io.BytesIO(zf.read(path))
-                file_obj = sub_file
-            with mrozip.ZipFile(file_obj, 'r') as zf:
+            with self._archive(main_path, path_list) as zf:
                 return zf.read(xml_info['xml_file'])
         except Exception as e:
             self.errlog.add_error(f"An error occurred while reading XML data: {e}")
             return None
 
+    def iter_xml_data(self, xml_list: List[Dict[str, str]]) -> Iterator:
+        # 按xml_list顺序产出(xml_info, data)；多线程预读，在途的解压字节受max_inflight_bytes限制
+        if self.workers <= 1:
+            for xml_info in xml_list:
+                yield xml_info, self.read_xml_data(xml_info)
+            return
+        budget = InflateBudget(self.max_inflight_bytes)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for xml_info in xml_list:
+                    nbytes = xml_info.get('size', 0)
+                    # 预算不足时先把最早的结果交给调用方，调用方处理完一个才释放一个的预算
+                    while pending and (len(pending) >= self.workers * 2 or not budget.try_acquire(nbytes)):
+                        done_info, done_bytes, future = pending.popleft()
+                        yield done_info, future.result()
+                        budget.release(done_bytes)
+                    if not pending:
+                        budget.acquire(nbytes)
+                    pending.append((xml_info, nbytes, executor.submit(self.read_xml_data, xml_info)))
+                while pending:
+                    done_info, done_bytes, future = pending.popleft()
+                    yield done_info, future.result()
+                    budget.release(done_bytes)
+            finally:
+                for _, _, future in pending:
+                    future.cancel()
+
+
+MRO_HEADERS = ["enb_id", "object_id", "MmeUeS1apId", "MmeCode", "MmeGroupId", "TimeStamp"]
+MRO_SC_PREFIX = ("MR.LteScEarfcn MR.LteScPci MR.LteScRSRP MR.LteScRSRQ "
+                 "MR.LteScTadv MR.LteScPHR MR.LteScAOA MR.LteScSinrUL")
+# 按规范取整数编号或计数的测量项；其余测量项（如各QCI丢包率）可能带小数
+MRO_INT_FIELDS = frozenset(MRO_SC_PREFIX.split() + [
+    "MR.LteNcEarfcn", "MR.LteNcPci", "MR.LteNcRSRP", "MR.LteNcRSRQ",
+    "MR.LteScRI1", "MR.LteScRI2", "MR.LteScRI4", "MR.LteScRI8",
+    "MR.LteScPUSCHPRBNum", "MR.LteScPDSCHPRBNum", "MR.LteSceNBRxTxTimeDiff"])
+CHUNK_SIZE = 1024 * 1024
+BATCH_ROWS = 10000
+
+
+def group_name(smr_fields) -> str:
+    # 测量组以smr的第一个字段命名，如MR.LteScEarfcn -> LteScEarfcn
+    return smr_fields[0].split('.', 1)[-1] if smr_fields else ''
+
+
+class MroSchema:
+    def __init__(self, smr_content: str):
+        self.smr_fields = smr_content.split()
+        self.group = group_name(self.smr_fields)
+        self.headers = MRO_HEADERS + self.smr_fields
+        # 测量项列表的签名，同一测量组在不同厂家/版本下字段顺序或数量可能不同，输出端按签名区分表结构
+        self.signature = hashlib.md5(' '.join(self.smr_fields).encode('utf-8')).hexdigest()[:8]
+        # 各测量项的取值类型，'int'或'float'，供输出端建表和列类型转换
+        self.value_types = ['int' if field in MRO_INT_FIELDS else 'float' for field in self.smr_fields]
+        self.width = len(self.headers)
+        self.columns = {header: i for i, header in enumerate(self.headers)}
+        self.is_default = smr_content.startswith(MRO_SC_PREFIX)
+
+
+_schemas: Dict[str, MroSchema] = {}
+
+
+def get_schema(smr_content: str) -> MroSchema:
+    # 同一smr签名只编译一次，之后按对象身份比较即可判断测量组是否切换
+    schema = _schemas.get(smr_content)
+    if schema is None:
+        schema = _schemas[smr_content] = MroSchema(smr_content)
+    return schema
+
+
+class _FastPathError(Exception):
+    pass
+
+
+# MRO-S固定结构的快速扫描用到的正则，只匹配<measurement><smr/><object><v/></object></measurement>
+# 属性值中的制表符和换行会被XML规范化为空格，这类写法交给通用路径
+_FAST_DECL = re.compile(r'\s*<\?xml([^>]*)\?>')
+_FAST_ENCODING = re.compile(r'encoding\s*=\s*["\']([^"\']*)["\']')
+_FAST_ENB = re.compile(r'<eNB\s[^>]*?(?<=\s)id="([^"<\t\n\r]*)"[^>]*(?<!/)>')
+_FAST_MEASUREMENT = re.compile(r'<measurement(?:\s[^>]*)?(?<!/)>\s*<smr>([^<]*)</smr>')
+_FAST_OBJECT = re.compile(r'<object\s+id="([^"<\t\n\r]*)"\s+MmeUeS1apId="([^"<\t\n\r]*)"\s+'
+                          r'MmeCode="([^"<\t\n\r]*)"\s+MmeGroupId="([^"<\t\n\r]*)"\s+'
+                          r'TimeStamp="([^"<\t\n\r]*)"\s*>((?:\s*<v>[^<]*</v>)*)\s*</object>')
+_FAST_V = re.compile(r'<v>([^<]*)</v>')
+_FAST_TAIL = re.compile(r'(?:\s*</[^<>\s]+\s*>)*\s*')
+_FAST_SPACE = re.compile(r'\s*')
+_FAST_LIMIT = 1024 * 1024
+
+
+class _FastReader:
+    # 按块读取并增量解码，只保留未处理的部分，内存不随文件大小增长
+    def __init__(self, fp, chunk_size: int = CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.checked = None
+        self.eof = False
+
+    def read(self) -> bool:
+        if self.eof:
+            return False
+        data = self.fp.read(self.chunk_size)
+        self.eof = not data
+        text = self.decoder.decode(data, final=self.eof)
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            if self.checked is not None:
+                self.checked -= self.pos
+            self.pos = 0
+        self.buf += text
+        self._check()
+        return bool(text) or not self.eof
+
+    def start_check(self, pos: int):
+        self.checked = pos
+        self._check()
+
+    def _check(self):
+        # 实体、注释、CDATA、处理指令和命名空间都交给通用路径；回看4个字符以覆盖跨块的标记
+        if self.checked is None:
+            return
+        start = max(self.checked - 4, 0)
+        buf = self.buf
+        if buf.find('&', start) >= 0 or buf.find('<!', start) >= 0 or buf.find('<?', start) >= 0 \
+                or buf.find('xmlns', start) >= 0:
+            raise _FastPathError("unsupported markup")
+        self.checked = len(buf)
+
+    def find(self, token: str, limit: int = _FAST_LIMIT) -> int:
+        # 从当前位置查找token，数据不够时继续读取，超过limit仍未找到视为结构不符
+        start = self.pos
+        while True:
+            index = self.buf.find(token, start)
+            if index >= 0:
+                return index
+            if len(self.buf) - self.pos > limit or not self.read():
+                raise _FastPathError("missing " + token)
+            start = max(len(self.buf) - len(token) - self.chunk_size, self.pos)
+
+    def skip_space(self):
+        while True:
+            self.pos = _FAST_SPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.read():
+                return
+
+    def startswith(self, token: str) -> bool:
+        while len(self.buf) - self.pos < len(token) and self.read():
+            pass
+        return self.buf.startswith(token, self.pos)
+
+    def match(self, pattern, end_token: str):
+        end = self.find(end_token) + len(end_token)
+        matched = pattern.match(self.buf, self.pos, end)
+        if matched is None or matched.end() != end:
+            raise _FastPathError(end_token)
+        self.pos = end
+        return matched
+
 
 class XmlParse:
-    def __init__(self, xmlio, mysql_info: MysqlInfo):
+    def __init__(self, xmlio, mysql_info: MysqlInfo, streaming: bool = False, all_groups: bool = False,
+                 fast_path: bool = False):
         self.xmlio = xmlio
         self.mysql_info = mysql_info
+        self.streaming = streaming
+        # 默认只输出LteScEarfcn开头的测量组，all_groups为True时输出全部测量组
+        self.all_groups = all_groups
+        # 固定结构的MRO-S文件可选走正则快速路径，结构不符时自动退回通用路径；
+        # 快速路径按块读取、逐个object输出，流式和非流式模式都可启用
+        self.fast_path = fast_path
         self.errlog = ErrorLog(self.mysql_info)
 
     def parse(self):
         try:
-            tree = etree.parse(self.xmlio)
-            enb_id = tree.find('.//eNB').attrib['id']
-            csvio = io.StringIO()
-            csv_writer = csv.writer(csvio)
-
-            headers_written = False
-
-            for measurement in tree.findall('.//measurement'):
-                smr_content = measurement.find('smr').text.strip()
-                if not smr_content.startswith(
-                        "MR.LteScEarfcn MR.LteScPci MR.LteScRSRP MR.LteScRSRQ "
-                        "MR.LteScTadv MR.LteScPHR MR.LteScAOA MR.LteScSinrUL"):
+            csvio = io.BytesIO()
+            self.write_to(csvio)
+            csvio.seek(0)
+            return csvio
+        except Exception as e:
+            self.errlog.add_error(e)
+
+    def parse_groups(self) -> Optional[Dict[str, io.BytesIO]]:
+        try:
+            outputs = {}
+            for schema, row_data in self._iter_rows():
+                output = outputs.get(schema.group)
+                if output is None:
+                    textio = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', newline='')
+                    output = outputs[schema.group] = [textio, csv.writer(textio), None]
+                if output[2] is not schema:
+                    output[1].writerow(schema.headers)
+                    output[2] = schema
+                output[1].writerow(row_data)
+            results = {}
+            for group, (textio, _, _) in outputs.items():
+                textio.flush()
+                results[group] = textio.detach()
+                results[group].seek(0)
+            return results
+        except Exception as e:
+            self.errlog.add_error(e)
+
+    def iter_rows(self, with_headers: bool = True) -> Iterator[List[str]]:
+        seen = set()
+        for schema, row_data in self._iter_rows():
+            if with_headers and schema not in seen:
+                seen.add(schema)
+                yield schema.headers
+            yield row_data
+
+    def iter_group_rows(self) -> Iterator[tuple]:
+        return self._iter_rows()
+
+    def iter_batches(self, batch_rows: int = BATCH_ROWS) -> Iterator[tuple]:
+        # 按测量块分批输出(headers, rows)，供输出端批量写入
+        cur_schema, batch = None, []
+        for schema, row_data in self._iter_rows():
+            if schema is not cur_schema or len(batch) >= batch_rows:
+                if batch:
+                    yield cur_schema.headers, batch
+                cur_schema, batch = schema, []
+            batch.append(row_data)
+        if batch:
+            yield cur_schema.headers, batch
+
+    def iter_arrays(self, batch_rows: int = BATCH_ROWS) -> Iterator[tuple]:
+        if np is None:
+            raise Exception("iter_arrays requires numpy")
+        for headers, rows in self.iter_batches(batch_rows):
+            yield headers, self.decode_block(headers, rows)
+
+    @staticmethod
+    def decode_block(headers, rows) -> Dict[str, object]:
+        # 按测量项定义的类型逐列转换，同一测量项在各块中的dtype固定：整数项为int64掩码数组，出现小数时退为
+        # float64；浮点项为float64，NIL为NaN。元数据列中缺失的属性(None)填空串并加掩码
+        width = len(headers)
+        meta_width = len(MRO_HEADERS)
+        value_types = get_schema(' '.join(headers[meta_width:])).value_types
+        rows = [row if len(row) == width else (row + ['NIL'] * width)[:width] for row in rows]
+        meta = np.array([row[:meta_width] for row in rows], dtype=object).reshape(len(rows), meta_width)
+        missing = np.equal(meta, None)
+        meta[missing] = ''
+        columns = {name: np.ma.MaskedArray(meta[:, i].astype(str), mask=missing[:, i])
+                   for i, name in enumerate(MRO_HEADERS)}
+        values = np.array([row[meta_width:] for row in rows], dtype=str).reshape(len(rows), width - meta_width)
+        mask = values == 'NIL'
+        filled = np.where(mask, '0', values)
+        for j, (header, value_type) in enumerate(zip(headers[meta_width:], value_types)):
+            if value_type == 'int':
+                try:
+                    columns[header] = np.ma.MaskedArray(filled[:, j].astype(np.int64), mask=mask[:, j])
                     continue
+                except ValueError:
+                    pass
+            column = filled[:, j].astype(np.float64)
+            column[mask[:, j]] = np.nan
+            columns[header] = column
+        return columns
 
-                smr_fields = smr_content.split()
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE, encoding: str = 'utf-8') -> Iterator[bytes]:
+        # 按固定大小输出编码后的CSV数据块，最后一块可能不足chunk_size
+        rowio = io.StringIO()
+        csv_writer = csv.writer(rowio)
+        pending = bytearray()
+        for row_data in self.iter_rows():
+            csv_writer.writerow(row_data)
+            pending += rowio.getvalue().encode(encoding)
+            rowio.seek(0)
+            rowio.truncate()
+            while len(pending) >= chunk_size:
+                yield bytes(pending[:chunk_size])
+                del pending[:chunk_size]
+        if pending:
+            yield bytes(pending)
 
-                for obj in measurement.findall('object'):
-                    object_id = obj.attrib['id']
-                    MmeUeS1apId = obj.attrib['MmeUeS1apId']
-                    MmeCode = obj.attrib['MmeCode']
-                    MmeGroupId = obj.attrib['MmeGroupId']
-                    TimeStamp = obj.attrib['TimeStamp']
+    def write_to(self, fp, chunk_size: int = CHUNK_SIZE) -> int:
+        written = 0
+        for chunk in self.iter_chunks(chunk_size):
+            fp.write(chunk)
+            written += len(chunk)
+        return written
 
-                    for v in obj.findall('v'):
-                        values = v.text.strip().split()
-                        row_data = [enb_id, object_id, MmeUeS1apId, MmeCode, MmeGroupId, TimeStamp] + values
+    def _iter_rows(self):
+        emitted = 0
+        if self.fast_path and self.xmlio.seekable():
+            start = self.xmlio.tell()
+            try:
+                for schema, rows in self._iter_objects_fast():
+                    for row_data in rows:
+                        yield schema, row_data
+                    emitted += len(rows)
+                return
+            except Exception:
+                # 快速路径按object校验完才输出，已输出的行与通用路径的前缀一致，退回后跳过这些行
+                Metrics.inc('xml_fast_fallback')
+                self.xmlio.seek(start)
+        objects = self._iter_objects_stream() if self.streaming else self._iter_objects_tree()
+        for enb_id, schema, attrs, v_texts in objects:
+            prefix = [enb_id, *attrs]
+            for text in v_texts:
+                if emitted:
+                    emitted -= 1
+                    continue
+                yield schema, prefix + text.strip().split()
 
-                        if not headers_written:
-                            headers = ["enb_id", "object_id", "MmeUeS1apId", "MmeCode", "MmeGroupId",
-                                       "TimeStamp"] + smr_fields
-                            csv_writer.writerow(headers)
-                            headers_written = True
+    def _iter_objects_fast(self):
+        # 逐个object校验并输出(schema, rows)，object属性须为标准顺序，其余写法交给通用路径
+        reader = _FastReader(self.xmlio)
+        reader.read()
+        if reader.buf.startswith('\ufeff'):
+            reader.pos = 1
+        reader.find('>')
+        decl = _FAST_DECL.match(reader.buf, reader.pos)
+        if decl is not None:
+            encoding = _FAST_ENCODING.search(decl.group(1))
+            if encoding is not None and encoding.group(1).lower() not in ('utf-8', 'utf8'):
+                raise _FastPathError("encoding")
+            reader.pos = decl.end()
+        reader.start_check(reader.pos)
+        index = reader.find('<eNB')
+        if reader.buf.find('<measurement', reader.pos, index) >= 0:
+            raise _FastPathError("measurement")
+        reader.pos = index
+        enb_id = reader.match(_FAST_ENB, '>').group(1)
+        while True:
+            reader.skip_space()
+            if reader.startswith('</eNB>'):
+                reader.pos += len('</eNB>')
+                break
+            if not reader.startswith('<measurement'):
+                raise _FastPathError("measurement")
+            schema = self._schema_text(reader.match(_FAST_MEASUREMENT, '</smr>').group(1).strip())
+            while True:
+                reader.skip_space()
+                if reader.startswith('</measurement>'):
+                    reader.pos += len('</measurement>')
+                    break
+                *attrs, obj_body = reader.match(_FAST_OBJECT, '</object>').groups()
+                if '<v></v>' in obj_body:
+                    raise _FastPathError("empty v")
+                if schema is not None:
+                    prefix = [enb_id, *attrs]
+                    yield schema, [prefix + v_text.split() for v_text in _FAST_V.findall(obj_body)]
+        # eNB之后只允许出现结束标签，多个eNB或其他内容都交给通用路径
+        while reader.read():
+            if len(reader.buf) - reader.pos > _FAST_LIMIT:
+                raise _FastPathError("tail")
+        if _FAST_TAIL.fullmatch(reader.buf, reader.pos) is None:
+            raise _FastPathError("tail")
 
-                        csv_writer.writerow(row_data)
+    @staticmethod
+    def _object_attrs(obj):
+        attrib = obj.attrib
+        # 非默认测量组的object可能不带MME相关属性，缺失时取None，不影响整个XML
+        return (attrib.get('id'), attrib.get('MmeUeS1apId'), attrib.get('MmeCode'), attrib.get('MmeGroupId'),
+                attrib.get('TimeStamp'))
 
-            csvio.seek(0)
-            return io.BytesIO(csvio.read().encode())
-        except Exception as e:
-            self.errlog.add_error(e)
+    def _schema(self, smr):
+        return self._schema_text((smr.text or '').strip() if smr is not None else '')
+
+    def _schema_text(self, smr_content):
+        if not smr_content:
+            return None
+        schema = get_schema(smr_content)
+        if not self.all_groups and not schema.is_default:
+            return None
+        return schema
+
+    def _iter_objects_tree(self):
+        tree = etree.parse(self.xmlio)
+        enb_id = tree.find('.//eNB').attrib['id']
+        for measurement in tree.findall('.//measurement'):
+            schema = self._schema(measurement.find('smr'))
+            if schema is None:
+                continue
+            for obj in measurement.findall('object'):
+                yield enb_id, schema, self._object_attrs(obj), [v.text for v in obj.findall('v')]
+
+    def _iter_objects_stream(self):
+        # 边解析边输出，每个object处理完即释放，避免整棵树驻留内存
+        enb_id, schema = None, None
+        context = etree.iterparse(self.xmlio, events=('start', 'end'),
+                                  tag=('eNB', 'measurement', 'smr', 'object'))
+        for event, elem in context:
+            tag = elem.tag
+            if event == 'start':
+                if tag == 'eNB':
+                    enb_id = elem.get('id')
+                elif tag == 'measurement':
+                    schema = None
+                continue
+            if tag == 'smr':
+                schema = self._schema(elem)
+            elif tag == 'object':
+                if schema is not None:
+                    yield enb_id, schema, self._object_attrs(elem), [v.text for v in elem.iterfind('v')]
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        del context
@@ -0,0 +1,117 @@
+import os
+import json
+import stat
+import ftplib
+import posixpath
+from datetime import date, timedelta
+
+from ftputil.error import FTPOSError
+
+import Metrics
+from ShareInfo import FtpInfo
+
+
+class IncrementalScanner:
+    def __init__(self, ftp_info: FtpInfo, state_path=None, recent_days=2, full_every=24):
+        self.ftpinfo = ftp_info
+        self.state_path = state_path or os.path.join(ftp_info.down_path, '.scanstate', f'{ftp_info.ftp_name}.json')
+        self.recent_days = recent_days
+        self.full_every = full_every
+        self.use_mlsd = None
+        self.scan_count = 0
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _recent_tokens(self):
+        tokens = []
+        for i in range(self.recent_days + 1):
+            day = date.today() - timedelta(days=i)
+            tokens.extend([day.strftime('%Y%m%d'), day.strftime('%Y-%m-%d'), day.strftime('%Y_%m_%d')])
+        return tokens
+
+    @staticmethod
+    def _list_mlsd(ftp, path):
+        # MLSD一次返回目录下所有条目的类型、大小和修改时间，由Sync.FtpHost经其FtpSession发出
+        files, dirs = {}, {}
+        for name, facts in ftp.mlsd(path, facts=['type', 'size', 'modify']):
+            entry_type = facts.get('type', '').lower()
+            if entry_type == 'file':
+                files[name] = [int(facts.get('size', -1)), facts.get('modify')]
+            elif entry_type == 'dir':
+                dirs[name] = facts.get('modify')
+        return files, dirs
+
+    @staticmethod
+    def _list_stat(ftp, path):
+        # ftputil的lstat按目录整体LIST并缓存，同目录内的条目只需一次往返
+        files, dirs = {}, {}
+        for name in ftp.listdir(path):
+            entry = ftp.lstat(posixpath.join(path, name))
+            if stat.S_ISDIR(entry.st_mode):
+                dirs[name] = entry.st_mtime
+            elif stat.S_ISREG(entry.st_mode):
+                files[name] = [entry.st_size, entry.st_mtime]
+        return files, dirs
+
+    def _list_dir(self, ftp, path):
+        with Metrics.timer('ftp_list'):
+            return self._list_dir_timed(ftp, path)
+
+    def _list_dir_timed(self, ftp, path):
+        if self.use_mlsd is not False and hasattr(ftp, 'mlsd'):
+            try:
+                result = self._list_mlsd(ftp, path)
+                self.use_mlsd = True
+                return result
+            except ftplib.error_perm:
+                if self.use_mlsd is None:
+                    self.use_mlsd = False
+                else:
+                    raise
+        return self._list_stat(ftp, path)
+
+    def scan(self, ftp, root):
+        # 只重新列出新出现、修改时间变化或名称落在近期日期窗口内的目录，其余沿用上次快照。
+        # 目录的mtime只随直接子项增删变化，子目录的mtime必须来自本轮对父目录的列表，
+        # 所以含子目录的目录每轮都列出，只有mtime未变的叶子目录沿用快照；
+        # 叶子目录内同名文件被原地改写不改变目录mtime，要等近期日期窗口或每full_every轮一次的全量扫描
+        self.scan_count += 1
+        full = not self.state or (self.full_every and (self.scan_count - 1) % self.full_every == 0)
+        recent = self._recent_tokens()
+        ftp.stat_cache.clear()
+        new_state = {}
+        result = []
+        stack = [(root, None, 0)]
+        while stack:
+            path, mtime, depth = stack.pop()
+            old = self.state.get(path)
+            if full or old is None or depth == 0 or mtime is None or mtime != old['mtime'] or old['dirs'] \
+                    or any(token in path for token in recent):
+                try:
+                    files, dirs = self._list_dir(ftp, path)
+                except (FTPOSError, ftplib.Error):
+                    # 目录已被删除或无权限，丢弃其快照
+                    continue
+            else:
+                files, dirs = old['files'], old['dirs']
+            new_state[path] = {'mtime': mtime, 'files': files, 'dirs': dirs}
+            for name, (size, file_mtime) in files.items():
+                result.append((posixpath.join(path, name), size, file_mtime))
+            for name, dir_mtime in dirs.items():
+                stack.append((posixpath.join(path, name), dir_mtime, depth + 1))
+        self.state = new_state
+        self.save()
+        return result
@@ -14,9 +14,22 @@ class FtpInfo:
         self.ftp_name, self.host, self.port, self.user, self.passwd, self.sync_path, \
             self.down_path, self.scan_filter = info.ftp_name, info.host, info.port, info.user, \
             info.passwd, info.sync_path, info.down_path, info.scan_filter
+        self.max_sessions, self.download_threads = info.max_sessions, info.download_threads
+        self.stream_mode, self.stream_threshold, self.stream_max = info.stream_mode, info.stream_threshold, \
+            info.stream_max
 
 
 class PerfInfo:
     def __init__(self, info=None):
         info = info or PerfInfo()
         self.processes, self.threads = info.processes, info.threads
+        self.metrics_path, self.metrics_port, self.metrics_interval = \
+            info.metrics_path, info.metrics_port, info.metrics_interval
+        self.fast_path = info.fast_path
+
+
+class SinkInfo:
+    def __init__(self, info=None):
+        info = info or SinkInfo()
+        self.sink_type, self.out_path, self.compression, self.chunk_rows = \
+            info.sink_type, info.out_path, info.compression, info.chunk_rows
@@ -0,0 +1,244 @@
+import os
+import re
+import csv
+import time
+import tempfile
+
+import pymysql
+
+from DbPool import get_pool
+from Parser import MRO_HEADERS, get_schema
+from ShareInfo import MysqlInfo, SinkInfo
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa, pq = None, None
+
+
+def column_name(header):
+    # MR.LteScRSRP -> LteScRSRP，并去掉不能作为列名的字符
+    return re.sub(r'\W', '_', header.split('.', 1)[-1])
+
+
+def partition_hour(timestamp):
+    # 2024-01-01T10:15:00.000 -> 2024010110，没有TimeStamp属性的对象归入unknown
+    if not timestamp:
+        return 'unknown'
+    return re.sub(r'\D', '', timestamp[:13])
+
+
+def schema_of(headers):
+    return get_schema(' '.join(headers[len(MRO_HEADERS):]))
+
+
+def _fit(row, width):
+    if len(row) == width:
+        return row
+    return row[:width] + [None] * (width - len(row))
+
+
+class ParquetSink:
+    def __init__(self, out_path, compression='zstd', merge_files=16, max_merge_rows=1000000):
+        if pa is None:
+            raise Exception("ParquetSink requires pyarrow")
+        self.out_path = out_path
+        self.compression = compression
+        # 每个XML落盘一个小文件，同一分区内本进程写的小文件攒够merge_files个合并为一个，
+        # 合并后超过max_merge_rows行的文件不再参与合并
+        self.merge_files = merge_files
+        self.max_merge_rows = max_merge_rows
+        self._buffers = {}
+        self._parts = {}
+        self._seq = 0
+
+    def write(self, headers, rows):
+        # 按测量组、字段布局、eNB和小时分区缓存，flush时每个分区写一个文件；
+        # 同组不同布局的行分到不同的layout分区，不会套用别的布局的列
+        schema = schema_of(headers)
+        for row in rows:
+            key = (schema.group, schema.signature, row[0], partition_hour(row[5]))
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = (headers, [])
+            buffer[1].append(row)
+
+    def _table(self, headers, rows):
+        width = len(headers)
+        value_types = schema_of(headers).value_types
+        columns = zip(*[_fit(row, width) for row in rows])
+        arrays, names = [], []
+        for i, (header, values) in enumerate(zip(headers, columns)):
+            array = pa.array([None if v == 'NIL' else v for v in values], pa.string())
+            if i >= len(MRO_HEADERS):
+                # 按测量项定义的类型转换，整数项出现小数时退为float64
+                targets = (pa.int64(), pa.float64()) if value_types[i - len(MRO_HEADERS)] == 'int' \
+                    else (pa.float64(),)
+                for target in targets:
+                    try:
+                        array = array.cast(target)
+                        break
+                    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                        continue
+            arrays.append(array)
+            names.append(column_name(header))
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def _part_path(self, path):
+        self._seq += 1
+        return os.path.join(path, f'part-{os.getpid()}-{int(time.time() * 1000)}-{self._seq}.parquet')
+
+    def _write_table(self, table, file_path):
+        pq.write_table(table, file_path + '.tmp', compression=self.compression)
+        os.replace(file_path + '.tmp', file_path)
+
+    def flush(self):
+        locations = []
+        for (group, signature, enb_id, hour), (headers, rows) in self._buffers.items():
+            path = os.path.join(self.out_path, f'group={group}', f'layout={signature}', f'enb={enb_id}',
+                                f'hour={hour}')
+            os.makedirs(path, exist_ok=True)
+            file_path = self._part_path(path)
+            self._write_table(self._table(headers, rows), file_path)
+            parts = self._parts.setdefault(path, [])
+            parts.append((file_path, len(rows)))
+            if len(parts) >= self.merge_files:
+                self._merge(path, parts)
+            locations.append(path)
+        self._buffers.clear()
+        return locations
+
+    def _merge(self, path, parts):
+        # 先写合并文件再删除原文件，中途失败时最多留下重复的数据文件，不会丢数据
+        try:
+            table = pa.concat_tables([pq.read_table(file_path) for file_path, _ in parts],
+                                     promote_options='permissive')
+            file_path = self._part_path(path)
+            self._write_table(table, file_path)
+        except (OSError, pa.ArrowException):
+            return
+        for old_path, _ in parts:
+            os.remove(old_path)
+        parts.clear()
+        if table.num_rows < self.max_merge_rows:
+            parts.append((file_path, table.num_rows))
+        else:
+            del self._parts[path]
+
+    def discard(self):
+        self._buffers.clear()
+
+    def close(self):
+        self.flush()
+
+
+class MysqlLoadSink:
+    def __init__(self, mysql_info: MysqlInfo, chunk_rows=100000, spool_dir=None):
+        self.mysql_info = mysql_info
+        self.db_name = mysql_info.db_name or 'mroparse'
+        self.chunk_rows = chunk_rows
+        self.spool_dir = spool_dir
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        self.conn = pymysql.connect(
+            host=mysql_info.host,
+            port=mysql_info.port,
+            user=mysql_info.user,
+            password=mysql_info.passwd,
+            database=self.db_name,
+            local_infile=True,
+            autocommit=False
+        )
+        self._tables = {}
+        self._spools = {}
+
+    def _table(self, headers):
+        # 表按测量组和字段布局签名命名，同组不同布局各建一张表，列与行严格对应
+        schema = schema_of(headers)
+        tb_name = f'mro_{column_name(schema.group).lower()}_{schema.signature}'
+        if tb_name not in self._tables:
+            columns = [column_name(header) for header in headers]
+            mr_columns = ', '.join(f'`{column}` {"INT" if value_type == "int" else "DOUBLE"} NULL'
+                                   for column, value_type in zip(columns[len(MRO_HEADERS):], schema.value_types))
+            # DDL会隐式提交当前事务，建表走连接池中的另一条连接，不影响正在装载的XML
+            with get_pool(self.mysql_info).connection() as conn, conn.cursor() as cursor:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS `{tb_name}` ("
+                               f"id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+                               f"enb_id VARCHAR(32) NOT NULL, "
+                               f"object_id VARCHAR(32) NULL, "
+                               f"MmeUeS1apId VARCHAR(32) NULL, "
+                               f"MmeCode VARCHAR(16) NULL, "
+                               f"MmeGroupId VARCHAR(16) NULL, "
+                               f"TimeStamp DATETIME(3) NULL, "
+                               f"{mr_columns}, "
+                               f"KEY idx_enb_time (enb_id, TimeStamp))")
+                conn.commit()
+            self._tables[tb_name] = columns
+        return tb_name
+
+    def write(self, headers, rows):
+        tb_name = self._table(headers)
+        width = len(self._tables[tb_name])
+        spool = self._spools.get(tb_name)
+        if spool is None:
+            f = tempfile.NamedTemporaryFile('w', newline='', suffix='.csv', delete=False, dir=self.spool_dir,
+                                            encoding='utf-8')
+            spool = self._spools[tb_name] = [f, csv.writer(f, lineterminator='\n'), 0]
+        for row in rows:
+            spool[1].writerow(['\\N' if v is None or v == 'NIL' else v for v in _fit(row, width)])
+        spool[2] += len(rows)
+        if spool[2] >= self.chunk_rows:
+            # 达到chunk_rows先装载以限制临时文件大小，但不提交，整个XML在flush时一次提交
+            self._load(tb_name)
+
+    def _load(self, tb_name):
+        f, _, count = self._spools.pop(tb_name)
+        f.close()
+        try:
+            if count:
+                columns = ', '.join(f'`{column}`' for column in self._tables[tb_name])
+                with self.conn.cursor() as cursor:
+                    cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE `{tb_name}` CHARACTER SET utf8mb4 "
+                                   f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                                   f"LINES TERMINATED BY '\\n' ({columns})", (f.name,))
+        finally:
+            os.remove(f.name)
+
+    def flush(self):
+        # 一个XML一个事务：全部表装载完才提交，任一步失败整体回滚，重试时不会重复入库
+        tables = list(self._spools)
+        try:
+            for tb_name in tables:
+                self._load(tb_name)
+            self.conn.commit()
+        except Exception:
+            self.discard()
+            raise
+        return tables
+
+    def discard(self):
+        for f, _, _ in self._spools.values():
+            f.close()
+            os.remove(f.name)
+        self._spools.clear()
+        try:
+            self.conn.rollback()
+        except pymysql.Error:
+            pass
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+
+def create_sink(sink_info: SinkInfo, mysql_info: MysqlInfo):
+    if sink_info is None:
+        return None
+    if sink_info.sink_type == 'parquet':
+        return ParquetSink(sink_info.out_path, sink_info.compression)
+    if sink_info.sink_type == 'mysql':
+        return MysqlLoadSink(mysql_info, sink_info.chunk_rows, sink_info.out_path)
+    return None
@@ -0,0 +1,100 @@
+import time
+import threading
+import multiprocessing
+
+import Metrics
+from Engine import ParseProcess
+from Logs import ErrorLog
+from ShareInfo import MysqlInfo, PerfInfo, SinkInfo
+from Sync import FtpScanProcess
+
+
+class Supervisor:
+    def __init__(self, mysql_info: MysqlInfo, perf_info: PerfInfo, ftp_infos, interval=60, check_interval=5,
+                 restart_delay=30, sink_info: SinkInfo = None):
+        self.mysql_info = mysql_info
+        self.perf_info = perf_info
+        # 本进程的指标配置；子进程在各自run()中按perf_info重新配置，spawn方式启动时同样生效
+        Metrics.configure(perf_info.metrics_path, perf_info.metrics_interval)
+        self.metrics_server = None
+        self.sink_info = sink_info
+        self.ftp_infos = list(ftp_infos)
+        self.interval = interval
+        self.check_interval = check_interval
+        self.restart_delay = restart_delay
+        self.manager = multiprocessing.Manager()
+        self.manager_dict = self.manager.dict()
+        self.manager_dict['status'] = True
+        self.sources = {}
+        self.parse_process = None
+        self.errlog = ErrorLog(mysql_info)
+        self._watch_thread = None
+
+    def _start_parse(self):
+        # 所有FTP源共用一个解析进程池，按源轮流认领任务
+        self.parse_process = ParseProcess(self.manager_dict, self.mysql_info, self.perf_info,
+                                          ftp_names=[info.ftp_name for info in self.ftp_infos],
+                                          sink_info=self.sink_info)
+        self.parse_process.start()
+
+    def _start_source(self, ftp_info):
+        source_dict = self.manager.dict()
+        source_dict['status'] = True
+        process = FtpScanProcess(source_dict, ftp_info, self.mysql_info, self.interval, sink_info=self.sink_info,
+                                 perf_info=self.perf_info)
+        process.start()
+        self.sources[ftp_info.ftp_name] = {'info': ftp_info, 'dict': source_dict, 'process': process,
+                                           'started': time.time(), 'restarts': 0}
+
+    def start(self):
+        if self.perf_info.metrics_path and self.perf_info.metrics_port:
+            self.metrics_server = Metrics.MetricsServer(self.perf_info.metrics_path, self.perf_info.metrics_port)
+            self.metrics_server.start()
+        self._start_parse()
+        for ftp_info in self.ftp_infos:
+            self._start_source(ftp_info)
+        self._watch_thread = threading.Thread(target=self._watch, daemon=True)
+        self._watch_thread.start()
+
+    def _watch(self):
+        while self.manager_dict['status']:
+            try:
+                now = time.time()
+                for ftp_name, source in list(self.sources.items()):
+                    if source['process'].is_alive() or now - source['started'] < self.restart_delay:
+                        continue
+                    # stop()可能在本轮检查期间被调用，此时退出的源不再重启
+                    if not self.manager_dict['status']:
+                        break
+                    # 每个源独立重启，一个源挂掉不影响其他源
+                    self.errlog.add_error('FTP pipeline {} exited with code {}, restarting'.format(
+                        ftp_name, source['process'].exitcode))
+                    Metrics.inc('process_restarts')
+                    restarts = source['restarts'] + 1
+                    self._start_source(source['info'])
+                    self.sources[ftp_name]['restarts'] = restarts
+                if not self.parse_process.is_alive() and self.manager_dict['status']:
+                    self.errlog.add_error('parse process exited with code {}, restarting'.format(
+                        self.parse_process.exitcode))
+                    Metrics.inc('process_restarts')
+                    self._start_parse()
+            except Exception as e:
+                self.errlog.add_error('supervisor error: {}'.format(str(e)))
+            for i in range(self.check_interval):
+                if not self.manager_dict['status']:
+                    break
+                time.sleep(1)
+
+    def stop(self):
+        self.manager_dict['status'] = False
+        for source in self.sources.values():
+            source['process'].stop()
+        self.parse_process.stop()
+        for source in self.sources.values():
+            source['process'].join()
+        self.parse_process.join()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.manager.shutdown()
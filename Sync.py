@@ -1,172 +1,517 @@
-import asyncio
+import ftplib
 import multiprocessing
 import os
+import queue
+import shutil
+import tempfile
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import ftputil
 from ftputil.error import FTPOSError
 
-from Logs import DownLog, ErrorLog
+import Metrics
+from Engine import parse_xml
+from Logs import DownLog, ErrorLog, ParseCache
 from Parser import MroPkg
-from ShareInfo import FtpInfo, MysqlInfo
+from Scanner import IncrementalScanner
+from ShareInfo import FtpInfo, MysqlInfo, PerfInfo, SinkInfo
+from Sinks import create_sink
 from Tasks import Task
 
 
+class FtpSession(ftplib.FTP):
+    def __init__(self, host, port, user, passwd, timeout=60):
+        super().__init__(timeout=timeout)
+        self.connect(host, port)
+        self.login(user, passwd)
+
+
+class FtpHost(ftputil.FTPHost):
+    def mlsd(self, path, facts=()):
+        # ftputil未封装MLSD，由本连接的FtpSession直接发出
+        return list(self._session.mlsd(path, facts=facts))
+
+
+def ftp_connect(ftp_info: FtpInfo, timeout=60):
+    # FTPHost的第四个位置参数是acct而不是端口，端口需要通过自定义session传入
+    return FtpHost(ftp_info.host, ftp_info.port if ftp_info.port > 0 else 21, ftp_info.user,
+                           ftp_info.passwd, timeout=timeout, session_factory=FtpSession)
+
+
+class FtpPool:
+    def __init__(self, ftp_info: FtpInfo, max_sessions=4, timeout=60):
+        self.ftpinfo = ftp_info
+        self.max_sessions = max(1, max_sessions)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.max_sessions)
+        self._closed = False
+
+    def _new_session(self):
+        return ftp_connect(self.ftpinfo, self.timeout)
+
+    @staticmethod
+    def _discard(ftp):
+        try:
+            ftp.close()
+        except (FTPOSError, Exception):
+            pass
+
+    @contextmanager
+    def session(self):
+        self._slots.acquire()
+        ftp = None
+        try:
+            try:
+                ftp = self._idle.get_nowait()
+                ftp.keep_alive()
+            except queue.Empty:
+                ftp = None
+            except (FTPOSError, Exception):
+                self._discard(ftp)
+                ftp = None
+            if ftp is None:
+                ftp = self._new_session()
+            try:
+                yield ftp
+            except Exception:
+                # 出错的会话状态不确定，直接丢弃，下次重新连接
+                self._discard(ftp)
+                ftp = None
+                raise
+        finally:
+            if ftp is not None:
+                if self._closed:
+                    self._discard(ftp)
+                else:
+                    self._idle.put(ftp)
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+class FtpDownloader:
+    def __init__(self, pool: FtpPool, download_func, threads=4, max_pending=None, max_done=None, error_func=None):
+        threads = max(1, threads)
+        self.pool = pool
+        self.download_func = download_func
+        self.error_func = error_func
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # 提交数和已完成未消费数都有上限，下游变慢时submit阻塞，反压到扫描
+        self._pending = threading.BoundedSemaphore(max_pending or threads * 2)
+        self.done_queue = queue.Queue(max_done or threads * 2)
+
+    def _run(self, file_info):
+        local_file = None
+        try:
+            with self.pool.session() as ftp:
+                local_file = self.download_func(file_info, ftp)
+        except (ftplib.Error, OSError, FTPOSError) as e:
+            # 连接级错误已让FtpPool.session丢弃该会话，这里只记录，文件按下载失败回报
+            if self.error_func is not None:
+                self.error_func(file_info, e)
+        finally:
+            # 无论成功与否都要回报，下游按提交数量收取结果
+            self.done_queue.put((file_info, local_file))
+            self._pending.release()
+
+    def submit(self, file_info, timeout=None):
+        if not self._pending.acquire(timeout=timeout):
+            return False
+        self.executor.submit(self._run, file_info)
+        return True
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+
+class UploadWatcher:
+    def __init__(self, stable_secs=9):
+        self.stable_secs = stable_secs
+        self.pending = {}
+        self.released = set()
+        self._lock = threading.Lock()
+
+    def add(self, file_info):
+        filepath = file_info[0]
+        with self._lock:
+            if filepath in self.pending or filepath in self.released:
+                return False
+            self.pending[filepath] = [file_info, file_info[1], None, time.time()]
+        return True
+
+    def done(self, filepath):
+        with self._lock:
+            self.released.discard(filepath)
+
+    def tick(self, ftp):
+        # 每轮清空stat缓存，lstat按目录整体列表一次，同目录的文件不再逐个查询
+        ftp.stat_cache.clear()
+        now = time.time()
+        ready = []
+        for filepath, state in list(self.pending.items()):
+            try:
+                with Metrics.timer('ftp_stat'):
+                    stat = ftp.lstat(filepath)
+            except (FTPOSError, Exception):
+                # 文件已被移走或改名，不再跟踪
+                del self.pending[filepath]
+                continue
+            if stat.st_size != state[1] or stat.st_mtime != state[2]:
+                state[1], state[2], state[3] = stat.st_size, stat.st_mtime, now
+            elif now - state[3] >= self.stable_secs:
+                # 大小和修改时间在stable_secs内均未变化，判定为对方已经上传完成
+                file_info = state[0]
+                ready.append((filepath, stat.st_size, now) + tuple(file_info[3:]))
+                with self._lock:
+                    del self.pending[filepath]
+                    self.released.add(filepath)
+        return ready
+
+
 class FtpScanClass:
 
     def __init__(self, manager_dict, ftp_info: FtpInfo, mysql_info: MysqlInfo):
         self.manager_dict = manager_dict
         self.ftpinfo = ftp_info
         self.ftp = None
+        self.errlog = ErrorLog(mysql_info)
         self.connect_to_ftp()
         self.db = DownLog(mysql_info, ftp_info.ftp_name)
-        self.errlog = ErrorLog(mysql_info)
+        self.scanner = IncrementalScanner(ftp_info)
 
     def connect_to_ftp(self):
         try:
-            self.ftp = ftputil.FTPHost(self.ftpinfo.host,
-                                       self.ftpinfo.user,
-                                       self.ftpinfo.passwd,
-                                       self.ftpinfo.port,
-                                       timeout=60)
+            self.ftp = ftp_connect(self.ftpinfo)
         except (FTPOSError, Exception) as e:
             self.errlog.add_error('Error for Ftp Connect: {}'.format(str(e)))
 
     def stop(self):
         self.manager_dict['status'] = False
 
-    def scan_newfiles(self):
+    def scan_newfiles(self, ftp=None):
+        # 扫描使用调用方从FtpPool借出的会话，连接级错误向上抛出，由FtpPool.session丢弃会话后下轮重连
+        if ftp is None:
+            with ftp_connect(self.ftpinfo) as ftp:
+                return self.scan_newfiles(ftp)
         try:
             ftp_path = self.ftpinfo.sync_path
-            scan_filter = self.ftpinfo.scan_filter.split('|')
+            scan_filter = [temp_dir for temp_dir in self.ftpinfo.scan_filter.split('|') if temp_dir]
             new_files = []
-            for root, dirs, files in self.ftp.walk(ftp_path):
+            self.db.refresh()
+            scan_time = time.time()
+            for ftp_file, file_size, _ in self.scanner.scan(ftp, ftp_path):
                 if not self.manager_dict['status']:
                     break
-                for name in files:
-                    ftp_file = self.ftp.path.join(root, name)
-                    if ftp_file.endswith('.zip') and not self.db.isexists(ftp_file):
-                        dir_name = self.ftp.path.dirname(ftp_path)
-                        if not any(temp_dir in dir_name for temp_dir in scan_filter):
-                            file_size = self.ftp.path.getsize(ftp_file)
-                            file_mtime = time.time()
-                            file_info = (ftp_file, file_size, file_mtime, self.ftpinfo.ftp_name)
-                            new_files.append(file_info)
-        except (FTPOSError, Exception) as e:
+                if ftp_file.endswith('.zip') and not self.db.isexists(ftp_file):
+                    dir_name = ftp.path.dirname(ftp_file)
+                    if not any(temp_dir in dir_name for temp_dir in scan_filter):
+                        new_files.append((ftp_file, file_size, scan_time, self.ftpinfo.ftp_name))
+        except (ftplib.Error, OSError, FTPOSError):
+            raise
+        except Exception as e:
             self.errlog.add_error(e)
             return []
 
         return sorted(new_files, key=lambda f: f[1])
 
-    def save_all_files_log(self):
+    def save_all_files_log(self, ftp=None):
         ftp_path = self.ftpinfo.sync_path
         try:
-            for root, dirs, files in self.ftp.walk(ftp_path):
-                for name in files:
-                    ftp_file = self.ftp.path.join(root, name)
-                    if ftp_file.endswith('.zip') and not self.db.isexists(ftp_file):
-                        self.db.savelog(ftp_file)
+            if ftp is None:
+                with ftp_connect(self.ftpinfo) as ftp:
+                    return self.save_all_files_log(ftp)
+            for ftp_file, _, _ in self.scanner.scan(ftp, ftp_path):
+                if ftp_file.endswith('.zip') and not self.db.isexists(ftp_file):
+                    self.db.savelog(ftp_file)
         except (FTPOSError, Exception) as e:
             self.errlog.add_error(e)
             return False
         return True
 
-    def file_download(self, file_info):
+    def local_path(self, filepath):
+        return os.path.join(
+            self.ftpinfo.down_path,
+            self.ftpinfo.ftp_name,
+            *os.path.normpath(filepath).split(os.path.sep))
+
+    def file_download(self, file_info, ftp=None):
+        # ftplib.Error、OSError、FTPOSError等连接级错误向上抛出，由FtpPool.session丢弃会话，调用方记录
         filepath = file_info[0]
         try:
-            filesize = file_info[1]
-            scantime = file_info[2]
-
-            with ftputil.FTPHost(self.ftpinfo.host, self.ftpinfo.user, self.ftpinfo.passwd, self.ftpinfo.port,
-                                 timeout=60) as ftp:
-                ftp_path = os.path.dirname(filepath)
-                ftp.chdir(ftp_path)
-                download_path = os.path.join(
-                    self.ftpinfo.down_path,
-                    self.ftpinfo.ftp_name,
-                    *os.path.normpath(filepath).split(os.path.sep))
-
-                os.makedirs(os.path.dirname(download_path), exist_ok=True)
-                init_size = filesize
-                size_change_time = scantime
-                # 检测文件大小是否发生变化，如果在一段时间内文件大小未发生变化则开始下载
-                while self.manager_dict['status']:
-                    cur_size = ftp.stat(filepath).cur_size = ftp.stat(filepath).st_size
-                    if cur_size != init_size:
-                        init_size = cur_size
-                        size_change_time = time.time()
-                    elif time.time() - size_change_time >= 9:
-                        # 文件大小未发生变化9秒，判定为对方已经上传完成
-                        ftp.download(filepath, download_path)
-                        return download_path
-                    time.sleep(3)
-
-        except (ftputil.error.FTPIOError, Exception) as e:
+            if ftp is None:
+                with ftp_connect(self.ftpinfo) as ftp:
+                    return self._download(ftp, file_info)
+            return self._download(ftp, file_info)
+        except (ftplib.Error, OSError, FTPOSError):
+            raise
+        except Exception as e:
             self.errlog.add_error('Error occurred while downloading file {}: {}'.format(filepath, str(e)))
             return None
 
+    def fetch_error(self, file_info, error):
+        self.errlog.add_error('Error occurred while fetching file {}: {}'.format(file_info[0], str(error)))
+
+    def file_fetch(self, file_info, ftp=None):
+        # 流式模式下不超过stream_max的包直接读入临时缓冲，不落盘
+        if self.ftpinfo.stream_mode and file_info[1] <= self.ftpinfo.stream_max:
+            return self.file_stream(file_info, ftp)
+        return self.file_download(file_info, ftp)
+
+    def file_stream(self, file_info, ftp=None):
+        filepath = file_info[0]
+        try:
+            if ftp is None:
+                with ftp_connect(self.ftpinfo) as ftp:
+                    return self._stream(ftp, file_info)
+            return self._stream(ftp, file_info)
+        except (ftplib.Error, OSError, FTPOSError):
+            raise
+        except Exception as e:
+            self.errlog.add_error('Error occurred while streaming file {}: {}'.format(filepath, str(e)))
+            return None
+
+    def _stream(self, ftp, file_info):
+        if not self.manager_dict['status']:
+            return None
+        os.makedirs(self.ftpinfo.down_path, exist_ok=True)
+        # 超过stream_threshold时SpooledTemporaryFile自动转存到down_path下的临时文件
+        spool = tempfile.SpooledTemporaryFile(max_size=self.ftpinfo.stream_threshold, dir=self.ftpinfo.down_path)
+        try:
+            with Metrics.timer('ftp_download'), ftp.open(file_info[0], 'rb') as remote:
+                shutil.copyfileobj(remote, spool, 1024 * 1024)
+            Metrics.inc('ftp_download_bytes', spool.tell())
+            spool.seek(0)
+        except Exception:
+            spool.close()
+            raise
+        return spool
+
+    def _download(self, ftp, file_info):
+        # 上传是否完成由UploadWatcher判定，这里只负责传输
+        if not self.manager_dict['status']:
+            return None
+        filepath = file_info[0]
+        ftp.chdir(os.path.dirname(filepath))
+        download_path = self.local_path(filepath)
+        os.makedirs(os.path.dirname(download_path), exist_ok=True)
+        with Metrics.timer('ftp_download'):
+            ftp.download(filepath, download_path)
+        Metrics.inc('ftp_download_bytes', os.path.getsize(download_path))
+        return download_path
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.ftp is not None:
             self.ftp.close()
 
 
 class FtpScanProcess(multiprocessing.Process):
-    def __init__(self, manager_dict, ftp_info: FtpInfo, mysql_info: MysqlInfo, interval=60):
+    def __init__(self, manager_dict, ftp_info: FtpInfo, mysql_info: MysqlInfo, interval=60, tick=3,
+                 sink_info: SinkInfo = None, enqueue_threads=2, max_backlog=200000, perf_info: PerfInfo = None):
         super().__init__()
         self.mro_tasks = None
         self.ftp_scan = None
         self.ftp_info = ftp_info
         self.mysq_linfo = mysql_info
         self.interval = interval
+        self.tick = tick
+        self.sink_info = sink_info
+        self.sink = None
+        self.enqueue_threads = max(1, enqueue_threads)
+        self.perf_info = perf_info
+        # 大包内的内层zip按PerfInfo.threads并行解压
+        self.unzip_workers = perf_info.threads if perf_info is not None else 1
+        self.fast_path = perf_info.fast_path if perf_info is not None else False
+        self.max_backlog = max_backlog
         self.manager_dict = manager_dict
         manager_dict['status'] = True
         self.errlog = None
-        self.semaphore = asyncio.Semaphore(1)
+        self.downloader = None
+        self.parse_cache = None
+        self.watcher = None
+        self._sink_lock = threading.Lock()
+        self._downloads_done = threading.Event()
 
     def run(self):
+        # 扫描/等待上传完成、下载、入库三个阶段各自独立的线程，阶段之间用有界队列连接：
+        # 下游变慢时上游在put/submit处阻塞，而不是在内存中堆积
         self.manager_dict['status'] = True
+        if self.perf_info is not None:
+            # spawn方式启动时不继承父进程的指标配置
+            Metrics.configure(self.perf_info.metrics_path, self.perf_info.metrics_interval)
         self.errlog = ErrorLog(self.mysq_linfo)
         self.ftp_scan = FtpScanClass(self.manager_dict, self.ftp_info, self.mysq_linfo)
 
         self.mro_tasks = Task(self.mysq_linfo)
+        self.parse_cache = ParseCache(self.mysq_linfo)
+        self.downloader = FtpDownloader(FtpPool(self.ftp_info, self.ftp_info.max_sessions),
+                                        self.ftp_scan.file_fetch,
+                                        self.ftp_info.download_threads,
+                                        error_func=self.ftp_scan.fetch_error)
+        self.watcher = UploadWatcher()
+        if self.ftp_info.stream_mode:
+            self.sink = create_sink(self.sink_info, self.mysq_linfo)
 
         if self.ftp_scan.ftp is None:
             self.errlog.add_error('error FTP Connect Fail')
             self.manager_dict['status'] = False
 
+        discover = threading.Thread(target=self._discover_loop, name='discover', daemon=True)
+        enqueuers = [threading.Thread(target=self._enqueue_loop, name=f'enqueue-{i}', daemon=True)
+                     for i in range(self.enqueue_threads)]
+        discover.start()
+        for thread in enqueuers:
+            thread.start()
+        while self.manager_dict['status']:
+            time.sleep(1)
+
+        # 先停上游，再等下载收尾，入库线程把已完成的下载全部处理完后退出
+        discover.join()
+        self.downloader.shutdown()
+        self._downloads_done.set()
+        for thread in enqueuers:
+            thread.join()
+        if self.sink is not None:
+            self.sink.close()
+
+    def _wait(self, seconds):
+        for i in range(seconds):
+            if not self.manager_dict['status']:
+                break
+            time.sleep(1)
+
+    def _discover_loop(self):
+        last_scan = 0
         while self.manager_dict['status']:
             try:
-                new_files = self.ftp_scan.scan_newfiles()
-                if new_files:
+                if time.time() - last_scan >= self.interval:
+                    last_scan = time.time()
+                    # 扫描和上传检查一样从连接池借会话，断线的会话被丢弃，下一轮自动重连
+                    with self.downloader.pool.session() as ftp:
+                        new_files = self.ftp_scan.scan_newfiles(ftp)
                     for file_info in new_files:
-                        if not self.manager_dict['status']:
-                            break
-                        local_file = self.ftp_scan.file_download(file_info)
-                        if local_file is not None:
-                            asyncio.run(self.parse_mro_file(local_file, file_info[3]))
-                        with DownLog(self.mysq_linfo, self.ftp_info.ftp_name) as db:
-                            print("save log")
-                            db.savelog(file_info[0])
-                for i in range(self.interval):
-                    if self.manager_dict['status']:
-                        time.sleep(1)
-                    else:
-                        break
+                        self.watcher.add(file_info)
+                Metrics.gauge('watcher_pending', len(self.watcher.pending))
+                Metrics.gauge('download_done_queue', self.downloader.done_queue.qsize())
+                if self.watcher.pending:
+                    with self.downloader.pool.session() as ftp:
+                        ready = self.watcher.tick(ftp)
+                    for file_info in ready:
+                        self._submit(file_info)
+                self._wait(self.tick)
             except Exception as e:
                 self.errlog.add_error('error: {}'.format(str(e)))
-                continue
 
-    async def parse_mro_file(self, file_path, ftp_name):
-        async with self.semaphore:
+    def _submit(self, file_info):
+        while not self.downloader.submit(file_info, timeout=1):
+            if not self.manager_dict['status']:
+                # 停止时尚未提交的文件不记日志，下次启动重新扫描
+                self.watcher.done(file_info[0])
+                return False
+        return True
+
+    def _enqueue_loop(self):
+        while True:
+            try:
+                file_info, local_file = self.downloader.done_queue.get(timeout=1)
+            except queue.Empty:
+                if self._downloads_done.is_set():
+                    return
+                continue
             try:
-                with ThreadPoolExecutor(max_workers=1) as pool:
-                    task_list = MroPkg(file_path).scan_xml_list()
-                    print(len(task_list))
-                    # task_list入库
-                    self.mro_tasks.tasks_add(task_list, ftp_name)
+                self._enqueue(file_info, local_file)
             except Exception as e:
-                self.errlog.add_error("unmrozip from file {} ; error: {}".format(file_path, str(e)))
+                self.errlog.add_error('error: {}'.format(str(e)))
+
+    def _wait_backlog(self, ftp_name):
+        # 解析跟不上时暂停入库，下载完成队列随之填满，反压传到下载和扫描
+        while self.max_backlog and self.manager_dict['status']:
+            backlog = self.mro_tasks.tasks_backlog(ftp_name)
+            Metrics.gauge('task_backlog', backlog)
+            if backlog < self.max_backlog:
+                break
+            Metrics.inc('backlog_waits')
+            self._wait(self.tick)
+
+    def _enqueue(self, file_info, local_file):
+        try:
+            if isinstance(local_file, str):
+                self._wait_backlog(file_info[3])
+                self.parse_mro_file(local_file, file_info[3])
+            elif local_file is not None:
+                try:
+                    if not self.parse_mro_stream(local_file, file_info):
+                        # 流式解析有失败的XML时落盘后按文件入任务表，由ParseProcess记录状态并重试；
+                        # 已解析成功的XML在ParseCache中有输出记录，入库时会被过滤
+                        self._wait_backlog(file_info[3])
+                        self.parse_mro_file(self._persist(local_file, file_info), file_info[3])
+                finally:
+                    local_file.close()
+            if local_file is not None:
+                # 下载失败（含FTP错误和因停止而中断）的不记日志，watcher释放后下次扫描重新下载
+                self.ftp_scan.db.savelog(file_info[0])
+        finally:
+            self.watcher.done(file_info[0])
+
+    def _persist(self, spool, file_info):
+        local_file = self.ftp_scan.local_path(file_info[0])
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        spool.seek(0)
+        with open(local_file, 'wb') as f:
+            shutil.copyfileobj(spool, f, 1024 * 1024)
+        return local_file
+
+    def parse_mro_file(self, file_path, ftp_name):
+        pkg = MroPkg(self.mysq_linfo, file_path, workers=self.unzip_workers)
+        try:
+            task_list = pkg.scan_xml_list()
+            # 跳过内容已解析过的重复XML
+            task_list = self.parse_cache.filter_new(task_list, ftp_name)
+            Metrics.inc('tasks_added', len(task_list))
+            # task_list入库，由ParseProcess认领解析
+            self.mro_tasks.tasks_add(task_list, ftp_name)
+        except Exception as e:
+            self.errlog.add_error("unmrozip from file {} ; error: {}".format(file_path, str(e)))
+        finally:
+            # 扫描进程只负责建任务，包内数据由ParseProcess读取，扫描完即关闭缓存中的映射和内层zip
+            pkg.release()
+
+    def parse_mro_stream(self, spool, file_info):
+        # 流式模式的包没有本地文件可供任务表引用，直接在本进程内解析；有XML解析失败时返回False
+        pkg = MroPkg(self.mysq_linfo, file_info[0], fileobj=spool, workers=self.unzip_workers)
+        ok = True
+        outputs = []
+        try:
+            xml_list = self.parse_cache.filter_new(pkg.scan_xml_list(), file_info[3])
+            for xml_info, data in pkg.iter_xml_data(xml_list):
+                # 多个入库线程共用同一个sink，逐个XML串行写入
+                with self._sink_lock:
+                    result = parse_xml(pkg, xml_info, self.mysq_linfo, self.sink, data,
+                                       fast_path=self.fast_path) if data is not None else None
+                if result is None:
+                    ok = False
+                    self.errlog.add_error("parse {} from stream {} failed".format(xml_info['xml_file'], file_info[0]))
+                else:
+                    outputs.append((file_info[3], xml_info['main'], xml_info['path'], xml_info['xml_file'],
+                                    result[1]))
+        except Exception as e:
+            ok = False
+            self.errlog.add_error("unmrozip from stream {} ; error: {}".format(file_info[0], str(e)))
+        finally:
+            # 中途出错时已写入sink的XML也要记录输出，落盘重投时不再重复解析
+            self.parse_cache.record_outputs(outputs)
+            pkg.release()
+        return ok
 
     def stop(self):
         self.manager_dict['status'] = False
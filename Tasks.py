@@ -1,145 +1,295 @@
+import asyncio
+import threading
 import datetime
 import pymysql
 import aiomysql
-from contextlib import closing
 from pymysql.cursors import DictCursor
 
+from DbPool import get_pool
 from ShareInfo import MysqlInfo
 from Logs import ErrorLog
 
 
 class Task:
-    def __init__(self, mysql_info: MysqlInfo):
+    def __init__(self, mysql_info: MysqlInfo, batch_size=500):
         self.host = mysql_info.host
         self.port = mysql_info.port
         self.user = mysql_info.user
         self.passwd = mysql_info.passwd
         self.db_name = mysql_info.db_name or 'mroparse'
         self.tb_name = 'mrotasks'
+        self.batch_size = batch_size
         self.errlog = ErrorLog(mysql_info)
-        self._initialize_database()
-
-    def _connect(self):
-        return pymysql.connect(
-            host=self.host,
-            port=self.port,
-            user=self.user,
-            passwd=self.passwd,
-            db=self.db_name,
-            cursorclass=DictCursor,
-            autocommit=False
-        )
-
-    def _initialize_database(self):
-        with closing(self._connect()) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(f"""
-                    CREATE TABLE IF NOT EXISTS {self.db_name} (
-                        task_id INT AUTO_INCREMENT PRIMARY KEY,
-                        main_zip VARCHAR(255) NOT NULL,
-                        sub_zip_path VARCHAR(255) NOT NULL,
-                        xml_file VARCHAR(255) NOT NULL,
-                        task_status ENUM('unparse','locked' , 'parsing', 'parsed') NOT NULL,
-                        uptime TIMESTAMP NOT NULL,
-                        ftp_name VARCHAR(255) NOT NULL
-                    )
-                """)
-
-                for index_name, column_name in [('idx_task_id', 'task_id'),
-                                                ('idx_ftp_name', 'ftp_name'),
-                                                ('idx_task_status', 'task_status')]:
-                    cursor.execute(f"SHOW INDEX FROM {self.db_name} WHERE KEY_NAME = '{index_name}'")
-                    if cursor.rowcount == 0:
-                        cursor.execute(f"CREATE INDEX {index_name} ON {self.db_name}({column_name})")
-
-            conn.commit()
-
-    @staticmethod
-    def _execute_update(conn, query):
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-        conn.commit()
-
-    def tasks_add(self, tasks, ftp_name):
-        with closing(self._connect()) as conn:
+        self.pool = get_pool(mysql_info)
+        self.pool.bootstrap(self.tb_name, self._initialize_database)
+
+    def _initialize_database(self, conn):
+        with conn.cursor(DictCursor) as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.tb_name} (
+                    task_id INT AUTO_INCREMENT PRIMARY KEY,
+                    main_zip VARCHAR(255) NOT NULL,
+                    sub_zip_path VARCHAR(255) NOT NULL,
+                    xml_file VARCHAR(255) NOT NULL,
+                    task_status ENUM('unparse','locked' , 'parsing', 'parsed', 'failed') NOT NULL,
+                    uptime TIMESTAMP NOT NULL,
+                    ftp_name VARCHAR(255) NOT NULL,
+                    task_key CHAR(32) AS (MD5(CONCAT_WS('|', ftp_name, main_zip, sub_zip_path, xml_file))) STORED,
+                    UNIQUE KEY uk_task_key (task_key)
+                )
+            """)
+
+            for index_name, column_name in [('idx_task_id', 'task_id'),
+                                            ('idx_ftp_name', 'ftp_name'),
+                                            ('idx_task_status', 'task_status')]:
+                cursor.execute(f"SHOW INDEX FROM {self.tb_name} WHERE KEY_NAME = '{index_name}'")
+                if cursor.rowcount == 0:
+                    cursor.execute(f"CREATE INDEX {index_name} ON {self.tb_name}({column_name})")
+
+            cursor.execute(f"SHOW COLUMNS FROM {self.tb_name} LIKE 'task_status'")
+            column = cursor.fetchone()
+            if column and "'failed'" not in column['Type']:
+                cursor.execute(f"ALTER TABLE {self.tb_name} MODIFY task_status "
+                               f"ENUM('unparse','locked' , 'parsing', 'parsed', 'failed') NOT NULL")
+
+            # 四个VARCHAR(255)超出索引长度上限，用其MD5生成列做唯一键
+            cursor.execute(f"SHOW COLUMNS FROM {self.tb_name} LIKE 'task_key'")
+            if cursor.rowcount == 0:
+                try:
+                    cursor.execute(f"ALTER TABLE {self.tb_name} ADD COLUMN task_key CHAR(32) AS "
+                                   f"(MD5(CONCAT_WS('|', ftp_name, main_zip, sub_zip_path, xml_file))) STORED, "
+                                   f"ADD UNIQUE KEY uk_task_key (task_key)")
+                except pymysql.Error as e:
+                    self.errlog.add_error(e)
+
+    def tasks_add(self, tasks, ftp_name, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(task['main'], task['path'], task['xml_file'], 'unparse', now, ftp_name) for task in tasks]
+        query = f"INSERT IGNORE INTO {self.tb_name} " \
+                f"(main_zip, sub_zip_path, xml_file, task_status, uptime, ftp_name) " \
+                f"VALUES (%s, %s, %s, %s, %s, %s)"
+        with self.pool.connection() as conn:
             try:
-                for task in tasks:
-                    main_zip = task['main'].replace('\\', '\\\\')
-                    sub_zip_path = task['path'].replace('\\', '\\\\')
-                    query = f"""
-                        INSERT INTO {self.db_name} 
-                        (main_zip, sub_zip_path, xml_file, task_status, uptime, ftp_name) 
-                        SELECT '{main_zip}', '{sub_zip_path}', '{task['xml_file']}', 'unparse', 
-                        '{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}', '{ftp_name}'
-                        FROM dual 
-                        WHERE NOT EXISTS (
-                            SELECT 1 FROM {self.db_name} 
-                            WHERE main_zip='{main_zip}' AND sub_zip_path='{sub_zip_path}' AND ftp_name='{ftp_name}'
-                        )
-                    """
-                    self._execute_update(conn, query)
+                with conn.cursor() as cursor:
+                    # executemany会合并为多行INSERT，每批一个事务
+                    for i in range(0, len(rows), batch_size):
+                        cursor.executemany(query, rows[i:i + batch_size])
+                        conn.commit()
             except Exception as e:
                 conn.rollback()
                 raise e
 
     def tasks_update(self, task_id, status):
         try:
-            with closing(self._connect()) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cursor:
-                    query = f"""
-                        UPDATE {self.db_name} 
-                        SET task_status='{status}', uptime='{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}' 
-                        WHERE task_id={task_id}
-                    """
-                    cursor.execute(query)
+                    cursor.execute(f"UPDATE {self.tb_name} SET task_status=%s, uptime=%s WHERE task_id=%s",
+                                   (status, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), task_id))
                 conn.commit()
         except Exception as e:
-            conn.rollback()
             self.errlog.add_error(e)
 
+    def tasks_claim(self, task_num, ftp_name=None):
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor(DictCursor) as cursor:
+                    query = f"SELECT task_id, main_zip, sub_zip_path, xml_file, ftp_name FROM {self.tb_name} " \
+                            f"WHERE task_status='unparse'"
+                    params = []
+                    if ftp_name is not None:
+                        query += " AND ftp_name=%s"
+                        params.append(ftp_name)
+                    query += " ORDER BY task_id LIMIT %s FOR UPDATE SKIP LOCKED"
+                    params.append(task_num)
+                    cursor.execute(query, params)
+                    tasks = list(cursor.fetchall())
+                    if tasks:
+                        cursor.execute(f"UPDATE {self.tb_name} SET task_status='parsing', uptime=%s "
+                                       f"WHERE task_id IN ({','.join(['%s'] * len(tasks))})",
+                                       [datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')] +
+                                       [task['task_id'] for task in tasks])
+                conn.commit()
+                return tasks
+            except pymysql.Error as e:
+                conn.rollback()
+                self.errlog.add_error(e)
+                return []
+
+    def tasks_update_many(self, task_ids, status):
+        return self.tasks_update_batch([(task_id, status) for task_id in task_ids])
+
+    def tasks_update_batch(self, updates, chunk_size=None):
+        # updates: [(task_id, status), ...]，按目标状态分组，每组一条 UPDATE ... IN (...)，同一事务提交
+        if not updates:
+            return True
+        chunk_size = chunk_size or self.batch_size
+        groups = {}
+        for task_id, status in updates:
+            groups.setdefault(status, []).append(task_id)
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    for status, task_ids in groups.items():
+                        for i in range(0, len(task_ids), chunk_size):
+                            chunk = task_ids[i:i + chunk_size]
+                            cursor.execute(f"UPDATE {self.tb_name} SET task_status=%s, uptime=%s "
+                                           f"WHERE task_id IN ({','.join(['%s'] * len(chunk))})",
+                                           [status, now] + chunk)
+                conn.commit()
+            except pymysql.Error as e:
+                conn.rollback()
+                self.errlog.add_error(e)
+                return False
+        return True
+
+    def tasks_backlog(self, ftp_name=None):
+        query = f"SELECT COUNT(*) FROM {self.tb_name} WHERE task_status='unparse'"
+        params = []
+        if ftp_name is not None:
+            query += " AND ftp_name=%s"
+            params.append(ftp_name)
+        try:
+            with self.pool.connection(autocommit=True) as conn, conn.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchone()[0]
+        except pymysql.Error as e:
+            self.errlog.add_error(e)
+            return 0
+
+    def tasks_reclaim(self, stale_secs=1800, ftp_name=None):
+        # 解析进程崩溃时认领的任务停留在parsing，超过stale_secs未更新的重新置为unparse
+        cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=stale_secs)).strftime('%Y-%m-%d %H:%M:%S')
+        query = f"UPDATE {self.tb_name} SET task_status='unparse', uptime=%s " \
+                f"WHERE task_status='parsing' AND uptime < %s"
+        params = [datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), cutoff]
+        if ftp_name is not None:
+            query += " AND ftp_name=%s"
+            params.append(ftp_name)
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    count = cursor.execute(query, params)
+                conn.commit()
+            except pymysql.Error as e:
+                conn.rollback()
+                self.errlog.add_error(e)
+                return 0
+        return count
+
+
+class StatusBuffer:
+    # 任务状态写回缓冲：累计到max_items条或距上次写入超过max_delay秒时批量写库，写库失败的保留到下次重试
+    def __init__(self, task: Task, max_items=1000, max_delay=2):
+        self.task = task
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='StatusBuffer', daemon=True)
+        self._thread.start()
+
+    def add(self, task_id, status):
+        with self._lock:
+            # 同一任务只保留最后一次状态
+            self._pending[task_id] = status
+            full = len(self._pending) >= self.max_items
+        if full:
+            self.flush()
+
+    def add_many(self, task_ids, status):
+        for task_id in task_ids:
+            self.add(task_id, status)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return True
+            try:
+                ok = self.task.tasks_update_batch(list(pending.items()))
+            except Exception as e:
+                self.task.errlog.add_error(e)
+                ok = False
+            if ok:
+                return True
+            with self._lock:
+                for task_id, status in pending.items():
+                    self._pending.setdefault(task_id, status)
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.max_delay):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(self.max_delay + 1)
+        return self.flush()
+
 
 class MroTaskAsync:
-    def __init__(self, mysql_info: MysqlInfo):
+    def __init__(self, mysql_info: MysqlInfo, minsize=1, maxsize=10):
         self.host = mysql_info.host
         self.port = mysql_info.port
         self.user = mysql_info.user
         self.passwd = mysql_info.passwd
         self.db_name = mysql_info.db_name or 'mroparse'
-        self.tb_name = mysql_info.tb_name or 'mrotasks'
+        self.tb_name = 'mrotasks'
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.pool = None
+        self._pool_lock = asyncio.Lock()
 
     async def _connect(self):
-        return await aiomysql.connect(
-            host=self.host,
-            port=self.port,
-            user=self.user,
-            password=self.passwd,
-            db=self.db_name,
-            autocommit=False
-        )
-
-    async def tasks_get(self, task_num, ftp_name):
-        tasks = []
-        try:
-            async with self._connect() as conn:
-                async with conn.cursor() as cursor:
-                    query = f"""
-                        SELECT * FROM {self.db_name} 
-                        WHERE task_status='unparse' AND ftp_name='{ftp_name}' 
-                        LIMIT {task_num} 
-                        FOR UPDATE
-                    """
-                    await cursor.execute(query)
-                    raw_tasks = await cursor.fetchall()
-
-                    for task in raw_tasks:
-                        query = f"""
-                            UPDATE {self.db_name} 
-                            SET task_status='parsing', uptime='{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}' 
-                            WHERE task_id={task['task_id']}
-                        """
-                        await cursor.execute(query)
-                    await conn.commit()
-        except Exception as e:
-            await conn.rollback()
-            raise e
+        async with self._pool_lock:
+            if self.pool is None:
+                self.pool = await aiomysql.create_pool(
+                    host=self.host,
+                    port=self.port,
+                    user=self.user,
+                    password=self.passwd,
+                    db=self.db_name,
+                    minsize=self.minsize,
+                    maxsize=self.maxsize,
+                    autocommit=False
+                )
+        return self.pool
+
+    async def tasks_get(self, task_num, ftp_name=None):
+        pool = await self._connect()
+        async with pool.acquire() as conn:
+            try:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    # SKIP LOCKED让并发的worker各自认领不同的行，不在行锁上排队
+                    query = f"SELECT task_id, main_zip, sub_zip_path, xml_file, ftp_name FROM {self.tb_name} " \
+                            f"WHERE task_status='unparse'"
+                    params = []
+                    if ftp_name is not None:
+                        query += " AND ftp_name=%s"
+                        params.append(ftp_name)
+                    query += " ORDER BY task_id LIMIT %s FOR UPDATE SKIP LOCKED"
+                    params.append(task_num)
+                    await cursor.execute(query, params)
+                    tasks = list(await cursor.fetchall())
+                    if tasks:
+                        await cursor.execute(f"UPDATE {self.tb_name} SET task_status='parsing', uptime=%s "
+                                             f"WHERE task_id IN ({','.join(['%s'] * len(tasks))})",
+                                             [datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')] +
+                                             [task['task_id'] for task in tasks])
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                raise e
         return tasks
+
+    async def close(self):
+        async with self._pool_lock:
+            if self.pool is not None:
+                self.pool.close()
+                await self.pool.wait_closed()
+                self.pool = None
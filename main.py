@@ -1,34 +1,30 @@
-
-import multiprocessing
 import sys
 import time
 
-from Config import MysqlInfo, FTPInfo
-from ShareInfo import MysqlInfo as Minfo, FtpInfo as Finfo
-from Sync import FtpScanProcess
+from Config import MysqlInfo, FTPInfo, PerfInfo, SinkInfo
+from ShareInfo import MysqlInfo as Minfo, FtpInfo as Finfo, PerfInfo as Pinfo, SinkInfo as Sinfo
+from Supervisor import Supervisor
 
 
 if __name__ == '__main__':
 
-    print(FTPInfo().check(), MysqlInfo().check())
-    finfo = Finfo(FTPInfo())
+    sections = FTPInfo.sections() or ['FTPInfo']
+    print([FTPInfo(cfg_name=section).check() for section in sections], MysqlInfo().check())
+    finfos = [Finfo(FTPInfo(cfg_name=section)) for section in sections]
     minfo = Minfo(MysqlInfo())
     minfo.db_name = "mroparse"
     minfo.tb_name = None
-    manager = multiprocessing.Manager()
-    manager_dict = manager.dict()
-    manager_dict['status'] = True
-    ftp_scan_process = FtpScanProcess(manager_dict, finfo, minfo, 10)
-    ftp_scan_process.start()
+    pinfo = Pinfo(PerfInfo())
+    sinfo = Sinfo(SinkInfo())
+    supervisor = Supervisor(minfo, pinfo, finfos, 10, sink_info=sinfo)
+    supervisor.start()
     time.sleep(1)
     print("start")
     while True:
         comm = input("command:")
         if comm == "exit":
-            ftp_scan_process.stop()
-            ftp_scan_process.join()
+            supervisor.stop()
             print("stoped")
             sys.exit()
         else:
             pass
-